@@ -0,0 +1,230 @@
+import argparse
+import asyncio
+import base64
+import binascii
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from aiohttp import web
+
+import metrics
+from backends import BACKENDS, exported_model_path, load_backend, load_labels
+from inference import InferenceEngine
+from prediction_cache import file_version
+from preprocessing import IMG_SIZE, Preprocessor, decode_grayscale
+
+logger = logging.getLogger("pneumoscan.api")
+
+MAX_REQUEST_MB = float(os.environ.get("PNEUMOSCAN_API_MAX_REQUEST_MB", "32"))
+MAX_IMAGES_PER_REQUEST = int(os.environ.get("PNEUMOSCAN_API_MAX_IMAGES", "64"))
+# Images accepted but not yet answered, across all requests; beyond this new requests get 503
+MAX_PENDING_IMAGES = int(os.environ.get("PNEUMOSCAN_API_MAX_PENDING", "256"))
+
+REQUEST_SECONDS = metrics.histogram("pneumoscan_api_request_seconds", "Time per successful classify request")
+REJECTED = metrics.counter("pneumoscan_api_rejected_total", "Classify requests rejected before inference", ["reason"])
+PENDING_IMAGES = metrics.gauge("pneumoscan_api_pending_images", "Images accepted by the API and not yet answered")
+
+
+# Holds the model for the lifetime of the process. Loading runs in the background so the
+# liveness probe answers immediately and readiness flips once the model has served a warm-up batch.
+class ModelService:
+    def __init__(self, model_path, labels_path, backend, max_batch_size=16, max_wait_ms=10,
+                 decode_threads=None, num_threads=None):
+        self.model_path = model_path
+        self.labels_path = labels_path
+        self.backend = backend
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.num_threads = num_threads
+        self.engine = None
+        self.class_labels = None
+        self.model_version = None
+        self.load_error = None
+        self.pending = 0
+        self.preprocessor = Preprocessor(size=IMG_SIZE, max_batch_size=1, pool_size=0)
+        self.executor = ThreadPoolExecutor(max_workers=decode_threads or os.cpu_count() or 1, thread_name_prefix="api-decode")
+        PENDING_IMAGES.set_function(lambda: self.pending)
+
+    @property
+    def ready(self):
+        return self.engine is not None
+
+    def load(self):
+        try:
+            self.class_labels = load_labels(self.labels_path)
+            self.model_version = file_version(exported_model_path(self.model_path, self.backend))
+            model = load_backend(self.model_path, self.backend, num_threads=self.num_threads)
+            engine = InferenceEngine(model, max_batch_size=self.max_batch_size, max_wait_ms=self.max_wait_ms)
+            engine.predict(np.zeros((IMG_SIZE, IMG_SIZE, 1), dtype=np.float32))
+            self.engine = engine
+            logger.info("Model %s (%s) ready", self.model_version, self.backend)
+        except Exception as e:
+            self.load_error = str(e)
+            logger.exception("Failed to load model")
+
+    def preprocess(self, data):
+        pixels = decode_grayscale(data)
+        return self.preprocessor.preprocess_pixels(pixels)
+
+    async def classify(self, images):
+        # images is a list of (name, encoded bytes); decode runs on the thread pool and all
+        # predictions are submitted to the shared engine, which batches them with other requests
+        loop = asyncio.get_running_loop()
+        decoded = await asyncio.gather(*(loop.run_in_executor(self.executor, self.preprocess, data) for _, data in images),
+                                       return_exceptions=True)
+        futures = [None if isinstance(tensor, BaseException) else asyncio.wrap_future(self.engine.submit(tensor))
+                   for tensor in decoded]
+        predictions = await asyncio.gather(*(f for f in futures if f is not None), return_exceptions=True)
+        predictions = iter(predictions)
+        results = []
+        for (name, _), tensor, future in zip(images, decoded, futures):
+            if future is None:
+                metrics.ERRORS.inc(stage="decode")
+                results.append({"name": name, "error": f"could not decode image: {tensor}"})
+                continue
+            prediction = next(predictions)
+            if isinstance(prediction, BaseException):
+                results.append({"name": name, "error": f"prediction failed: {prediction}"})
+                continue
+            index = int(np.argmax(prediction))
+            results.append({"name": name, "prediction": self.class_labels[index],
+                            "confidence": float(prediction[index]) * 100,
+                            "probabilities": [float(p) for p in prediction]})
+        return results
+
+
+async def read_images(request):
+    # multipart/form-data with one file part per image, or JSON {"images": [{"name", "data"}]}
+    # with base64 data (plain base64 strings are accepted too)
+    images = []
+    max_size = request.app["max_request_bytes"]
+    if request.content_type.startswith("multipart/"):
+        # Streamed multipart bodies are not covered by client_max_size, so count bytes here
+        total = 0
+        reader = await request.multipart()
+        async for part in reader:
+            if len(images) >= MAX_IMAGES_PER_REQUEST:
+                raise web.HTTPRequestEntityTooLarge(max_size=MAX_IMAGES_PER_REQUEST, actual_size=len(images) + 1,
+                                                    text=f"at most {MAX_IMAGES_PER_REQUEST} images per request")
+            data = bytearray()
+            while chunk := await part.read_chunk():
+                total += len(chunk)
+                if total > max_size:
+                    raise web.HTTPRequestEntityTooLarge(max_size=max_size, actual_size=total)
+                data.extend(chunk)
+            images.append((part.filename or part.name or f"image-{len(images)}", bytes(data)))
+        return images
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="expected multipart/form-data or a JSON body")
+    entries = body.get("images") if isinstance(body, dict) else None
+    if not isinstance(entries, list):
+        raise web.HTTPBadRequest(text='JSON body must have an "images" list')
+    if len(entries) > MAX_IMAGES_PER_REQUEST:
+        raise web.HTTPRequestEntityTooLarge(max_size=MAX_IMAGES_PER_REQUEST, actual_size=len(entries),
+                                            text=f"at most {MAX_IMAGES_PER_REQUEST} images per request")
+    for i, entry in enumerate(entries):
+        name, data = (entry.get("name", f"image-{i}"), entry.get("data")) if isinstance(entry, dict) else (f"image-{i}", entry)
+        try:
+            images.append((name, base64.b64decode(data, validate=True)))
+        except (TypeError, binascii.Error):
+            raise web.HTTPBadRequest(text=f"{name}: data is not valid base64")
+    return images
+
+
+async def classify(request):
+    service = request.app["service"]
+    start = time.perf_counter()
+    if not service.ready:
+        REJECTED.inc(reason="not_ready")
+        raise web.HTTPServiceUnavailable(text="model is loading", headers={"Retry-After": "5"})
+    # Backpressure: shed load before reading the body instead of letting the engine queue grow
+    if service.pending >= MAX_PENDING_IMAGES:
+        REJECTED.inc(reason="overloaded")
+        raise web.HTTPServiceUnavailable(text="inference queue is full", headers={"Retry-After": "1"})
+    try:
+        images = await read_images(request)
+    except web.HTTPRequestEntityTooLarge:
+        REJECTED.inc(reason="too_large")
+        raise
+    if not images:
+        raise web.HTTPBadRequest(text="no images in request")
+    if service.pending + len(images) > MAX_PENDING_IMAGES:
+        REJECTED.inc(reason="overloaded")
+        raise web.HTTPServiceUnavailable(text="inference queue is full", headers={"Retry-After": "1"})
+    service.pending += len(images)
+    try:
+        results = await service.classify(images)
+    finally:
+        service.pending -= len(images)
+    REQUEST_SECONDS.observe(time.perf_counter() - start)
+    return web.json_response({"model_version": service.model_version, "backend": service.backend, "results": results})
+
+
+async def health(request):
+    return web.json_response({"status": "ok"})
+
+
+async def ready(request):
+    service = request.app["service"]
+    body = {"ready": service.ready, "model_version": service.model_version, "backend": service.backend,
+            "pending_images": service.pending,
+            "queue_depth": service.engine.queue_depth() if service.engine else None}
+    if service.load_error:
+        body["error"] = service.load_error
+    return web.json_response(body, status=200 if service.ready else 503)
+
+
+async def metrics_text(request):
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+
+def create_app(service):
+    # aiohttp rejects bodies over client_max_size with 413 before they are buffered
+    max_request_bytes = int(MAX_REQUEST_MB * 1024 * 1024)
+    app = web.Application(client_max_size=max_request_bytes)
+    app["service"] = service
+    app["max_request_bytes"] = max_request_bytes
+    app.router.add_post("/v1/classify", classify)
+    app.router.add_get("/healthz", health)
+    app.router.add_get("/readyz", ready)
+    app.router.add_get("/metrics", metrics_text)
+
+    async def start_loading(app):
+        app["loader"] = asyncio.get_running_loop().run_in_executor(None, service.load)
+
+    async def stop_engine(app):
+        if service.engine is not None:
+            service.engine.shutdown()
+        service.executor.shutdown(wait=False)
+
+    app.on_startup.append(start_loading)
+    app.on_cleanup.append(stop_engine)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP inference service for the pneumonia classifier")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--model", default="best_model.h5")
+    parser.add_argument("--labels", default="class_labels.json")
+    parser.add_argument("--backend", choices=BACKENDS, default=os.environ.get("PNEUMOSCAN_BACKEND", "keras"))
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=10)
+    parser.add_argument("--decode-threads", type=int, help="Threads decoding uploads (default: all cores)")
+    parser.add_argument("--threads", type=int, help="Intra-op threads for the TFLite backends")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    service = ModelService(args.model, args.labels, args.backend, max_batch_size=args.max_batch_size,
+                           max_wait_ms=args.max_wait_ms, decode_threads=args.decode_threads, num_threads=args.threads)
+    web.run_app(create_app(service), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import base64
+import io
+import json
+import time
+import urllib.error
+import urllib.request
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from preprocessing import IMG_SIZE
+
+
+# Client for api.py, built on the standard library so UI workers need neither TensorFlow nor
+# an HTTP client package. predict_pixels mirrors InferenceEngine.predict_many: it returns one
+# probability vector per image, so callers keep their argmax/label code unchanged.
+class InferenceClient:
+    def __init__(self, base_url, timeout=30.0, retries=3, version_ttl=30.0, max_images_per_request=64,
+                 max_request_mb=32):
+        self.base_url = base_url.rstrip("/")
+        # Keep in line with the service's PNEUMOSCAN_API_MAX_IMAGES and PNEUMOSCAN_API_MAX_REQUEST_MB
+        self.max_images_per_request = max_images_per_request
+        self.max_request_bytes = int(max_request_mb * 1024 * 1024)
+        self.timeout = timeout
+        self.retries = retries
+        self.version_ttl = version_ttl
+        self._version = None
+        self._version_checked = 0.0
+
+    def _request(self, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        for attempt in range(self.retries + 1):
+            request = urllib.request.Request(self.base_url + path, data=data, headers=headers)
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    return json.loads(response.read())
+            except urllib.error.HTTPError as e:
+                # 503 means loading or shedding load; honour Retry-After, fail on anything else
+                if e.code != 503 or attempt == self.retries:
+                    raise RuntimeError(f"inference API {path} failed: {e.code} {e.read().decode(errors='replace')}") from e
+                time.sleep(float(e.headers.get("Retry-After", "1")))
+
+    def ready(self):
+        try:
+            return self._request("/readyz").get("ready", False)
+        except (OSError, RuntimeError):
+            return False
+
+    def model_version(self):
+        # Cached for version_ttl seconds; used to key predictions the same way the local model hash is
+        now = time.monotonic()
+        if self._version is None or now - self._version_checked > self.version_ttl:
+            try:
+                self._version = self._request("/readyz").get("model_version") or self._version
+                self._version_checked = now
+            except (OSError, RuntimeError):
+                pass
+        return self._version
+
+    def classify(self, images):
+        # images is a list of (name, encoded bytes); returns the API's per-image result dicts.
+        # Split into as many requests as the service's count and size limits need
+        results = []
+        for body in self._bodies(images):
+            response = self._request("/v1/classify", body)
+            self._version = response.get("model_version", self._version)
+            results.extend(response["results"])
+        return results
+
+    def _bodies(self, images):
+        # JSON bodies of at most max_images_per_request images and max_request_bytes each
+        # (base64 data plus a little room per entry for names and JSON syntax)
+        entries, size = [], 0
+        for name, data in images:
+            entry = {"name": name, "data": base64.b64encode(data).decode("ascii")}
+            entry_size = len(entry["data"]) + len(name) + 64
+            if entries and (len(entries) == self.max_images_per_request or size + entry_size > self.max_request_bytes):
+                yield {"images": entries}
+                entries, size = [], 0
+            entries.append(entry)
+            size += entry_size
+        if entries:
+            yield {"images": entries}
+
+    def predict_pixels(self, pixels_list):
+        # Sends decoded grayscale pixels as lossless PNGs, already resized to the model input the
+        # same way Preprocessor does, so the service's resize is a no-op, predictions match local
+        # inference and each image costs a few tens of KB of request body instead of a full-size X-ray
+        images = []
+        for i, pixels in enumerate(pixels_list):
+            if pixels.shape != (IMG_SIZE, IMG_SIZE):
+                pixels = cv2.resize(pixels, (IMG_SIZE, IMG_SIZE), interpolation=cv2.INTER_LINEAR)
+            buffer = io.BytesIO()
+            Image.fromarray(pixels).save(buffer, format="PNG", compress_level=1)
+            images.append((f"image-{i}", buffer.getvalue()))
+        results = self.classify(images)
+        for result in results:
+            if "error" in result:
+                raise RuntimeError(f"inference API: {result['error']}")
+        return [np.array(result["probabilities"], dtype=np.float32) for result in results]
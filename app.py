@@ -1,100 +1,171 @@
+import startup_timing
 import streamlit as st
-import tensorflow as tf
-import numpy as np
-import cv2
 from PIL import Image
-import json
+import logging
+import os
+import threading
 import time
-import sqlite3
-import hashlib
-import uuid
-from datetime import datetime
+import metrics
+from metrics import ERRORS, STAGE_SECONDS
+from db import (authenticate, claim_review_cases, count_patient_records, create_user, get_patient_records, get_patients,
+                get_pool, records_generation, release_claims, save_patient_record, save_patient_records,
+                update_prescription)
+from prediction_cache import PredictionCache, file_version
+from bulk_scan import chunked, count_upload_images, iter_upload_images
+
+# tensorflow, numpy and cv2 are imported lazily inside the inference code paths
+# so the landing page renders without paying for them
+startup_timing.mark("imports")
 
 # Set Page Config
 st.set_page_config(page_title="PneumoScan AI", page_icon="🫁", layout="wide")
 
 # Database setup
-def init_db():
-    conn = sqlite3.connect('pneumonia_app.db', check_same_thread=False)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-        id TEXT PRIMARY KEY, username TEXT UNIQUE NOT NULL, password TEXT NOT NULL,
-        role TEXT NOT NULL, name TEXT, email TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS patient_records (
-        id TEXT PRIMARY KEY, patient_id TEXT NOT NULL, image_path TEXT,
-        prediction TEXT, confidence REAL, status TEXT DEFAULT 'Pending',
-        notes TEXT, prescription TEXT, created_at TIMESTAMP,
-        FOREIGN KEY (patient_id) REFERENCES users (id))''')
-    conn.commit()
-    return conn
-
-conn = init_db()
+get_pool()
+startup_timing.mark("db_ready")
 
 # Load model and labels
+# Inference backend: "keras" (default), "tflite" or "tflite-int8" (see export_model.py)
+MODEL_PATH = "best_model.h5"
+INFERENCE_BACKEND = os.environ.get("PNEUMOSCAN_BACKEND", "keras")
+# Model worker processes fed through shared memory (see worker_pool.py); 0 runs the model in this process
+MODEL_WORKERS = int(os.environ.get("PNEUMOSCAN_MODEL_WORKERS", "0"))
+# Scans whose confidence (%) falls below PNEUMOSCAN_REFINE_BELOW are re-scored with test-time
+# augmentation (PNEUMOSCAN_TTA, PNEUMOSCAN_TTA_SHIFT) and/or the extra checkpoints listed in
+# PNEUMOSCAN_ENSEMBLE; 0 disables it
+REFINE_BELOW = float(os.environ.get("PNEUMOSCAN_REFINE_BELOW", "0"))
+TTA_ENABLED = os.environ.get("PNEUMOSCAN_TTA", "1") == "1"
+TTA_SHIFT = int(os.environ.get("PNEUMOSCAN_TTA_SHIFT", "8"))
+ENSEMBLE_MODELS = [path.strip() for path in os.environ.get("PNEUMOSCAN_ENSEMBLE", "").split(",") if path.strip()]
+# When set (e.g. http://127.0.0.1:8600), predictions come from api.py and this process never loads the model
+INFERENCE_API_URL = os.environ.get("PNEUMOSCAN_API_URL")
+
 @st.cache_resource
 def load_model():
-    return tf.keras.models.load_model("best_model.h5")
+    # Returns (model, model version); the version is the hash of the file this model was loaded
+    # from, since st.cache_resource keeps serving it after best_model.h5 is replaced
+    from backends import exported_model_path, load_backend
+    model_version = file_version(exported_model_path(MODEL_PATH, INFERENCE_BACKEND))
+    model = load_backend(MODEL_PATH, INFERENCE_BACKEND)
+    startup_timing.mark("model_loaded")
+    return model, model_version
 
 @st.cache_resource
-def load_labels():
-    with open("class_labels.json", "r") as file:
-        return {int(k): v for k, v in json.load(file).items()}
+def get_inference_engine():
+    # One engine per process, shared by every session so concurrent uploads are batched together.
+    # Returns (engine, model version) like load_model
+    if MODEL_WORKERS:
+        from backends import exported_model_path
+        from worker_pool import WorkerPool
+        model_version = file_version(exported_model_path(MODEL_PATH, INFERENCE_BACKEND))
+        return WorkerPool(MODEL_PATH, INFERENCE_BACKEND, num_workers=MODEL_WORKERS, num_classes=len(load_labels()),
+                          max_batch_size=16), model_version
+    from inference import InferenceEngine
+    model, model_version = load_model()
+    return InferenceEngine(model, max_batch_size=16, max_wait_ms=10), model_version
 
-# Authentication functions
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+@st.cache_resource
+def get_api_client():
+    from api_client import InferenceClient
+    return InferenceClient(INFERENCE_API_URL)
 
-def create_user(username, password, role, name="", email=""):
-    c = conn.cursor()
-    user_id = str(uuid.uuid4())
-    try:
-        c.execute("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)",
-            (user_id, username, hash_password(password), role, name, email))
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        return False
-
-def authenticate(username, password):
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE username = ? AND password = ?", 
-              (username, hash_password(password)))
-    user = c.fetchone()
-    return {"id": user[0], "username": user[1], "role": user[3], 
-            "name": user[4], "email": user[5]} if user else None
-
-def save_patient_record(patient_id, prediction, confidence, image_path=None):
-    c = conn.cursor()
-    record_id = str(uuid.uuid4())
-    c.execute("INSERT INTO patient_records (id, patient_id, prediction, confidence, image_path, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-        (record_id, patient_id, prediction, confidence, image_path, datetime.now()))
-    conn.commit()
-    return record_id
-
-def update_prescription(record_id, prescription, notes):
-    c = conn.cursor()
-    c.execute("UPDATE patient_records SET prescription = ?, notes = ?, status = 'Reviewed' WHERE id = ?",
-        (prescription, notes, record_id))
-    conn.commit()
-
-def get_patient_records(patient_id=None):
-    c = conn.cursor()
-    query = """SELECT pr.*, u.name, u.username 
-            FROM patient_records pr
-            JOIN users u ON pr.patient_id = u.id"""
-    if patient_id:
-        query += " WHERE pr.patient_id = ?"
-        c.execute(query + " ORDER BY pr.created_at DESC", (patient_id,))
+def predict_scans(pixels, batch):
+    # batch holds the normalized tensors for pixels; returns one probability vector per scan
+    if INFERENCE_API_URL:
+        predictions = get_api_client().predict_pixels(pixels)
     else:
-        c.execute(query + " ORDER BY pr.created_at DESC")
-    
-    records = c.fetchall()
-    formatted_records = []
-    for record in records:
-        record = list(record)
-        record[4] = float(record[4]) if not isinstance(record[4], bytes) else float.fromhex(record[4].hex())
-        formatted_records.append(tuple(record))
-    return formatted_records
+        predictions = get_inference_engine()[0].predict_many(batch)
+    startup_timing.mark("first_prediction", report=True)
+    return predictions
+
+def predict_views(views):
+    # All rows in one model call
+    if INFERENCE_API_URL:
+        import numpy as np
+        return np.stack(get_api_client().predict_pixels(np.rint(views[..., 0] * 255).astype(np.uint8)))
+    return get_inference_engine()[0].predict_batch(views)
+
+@st.cache_resource
+def get_refiner():
+    from scan_pipeline import build_refiner
+    return build_refiner(predict_views, REFINE_BELOW, tta=TTA_ENABLED, shift=TTA_SHIFT, ensemble_models=ENSEMBLE_MODELS,
+                         backend=INFERENCE_BACKEND)
+
+@st.cache_resource
+def get_preprocessor():
+    from preprocessing import Preprocessor
+    return Preprocessor(size=150, max_batch_size=16)
+
+def warm_up_model():
+    import numpy as np
+    get_inference_engine()[0].predict(np.zeros((150, 150, 1), dtype=np.float32))
+    startup_timing.mark("model_warm", report=True)
+
+@st.cache_resource
+def start_warm_up():
+    # Opt-in with PNEUMOSCAN_WARMUP=1: load the model and run a dummy predict in the background at startup
+    thread = threading.Thread(target=warm_up_model, name="model-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+if os.environ.get("PNEUMOSCAN_WARMUP") == "1" and not INFERENCE_API_URL:
+    start_warm_up()
+
+logger = logging.getLogger("pneumoscan.app")
+
+# Prometheus text endpoint, opt-in with PNEUMOSCAN_METRICS_PORT; binds to localhost unless
+# PNEUMOSCAN_METRICS_HOST says otherwise
+METRICS_PORT = os.environ.get("PNEUMOSCAN_METRICS_PORT")
+METRICS_HOST = os.environ.get("PNEUMOSCAN_METRICS_HOST", "127.0.0.1")
+# Comma-separated doctor usernames allowed on the metrics page; "*" allows every doctor. Anyone can
+# register as a doctor, so when unset nobody is an admin
+ADMIN_USERS = {name.strip() for name in os.environ.get("PNEUMOSCAN_ADMINS", "").split(",") if name.strip()}
+
+@st.cache_resource
+def start_metrics_server():
+    return metrics.start_http_server(int(METRICS_PORT), METRICS_HOST)
+
+if METRICS_PORT:
+    start_metrics_server()
+
+@st.cache_resource
+def get_prediction_cache():
+    # Keyed on the serving model's version, so lookups load the model if nothing has yet
+    return PredictionCache("prediction_cache.db", version_fn=current_model_version, max_entries=10000)
+
+def current_model_version():
+    # Version of the model that is actually serving predictions: the one the API reports, or the
+    # hash taken when this process loaded the model. Replacing best_model.h5 takes effect (and
+    # changes this) only after a restart
+    if INFERENCE_API_URL:
+        return get_api_client().model_version()
+    return get_inference_engine()[1]
+
+@st.cache_resource
+def get_image_store():
+    from image_store import ImageStore
+    return ImageStore("image_store")
+
+@st.cache_resource
+def get_gradcam():
+    from gradcam import load_gradcam
+    # Reuse the serving model when it is the Keras model loaded in this process. Otherwise (worker
+    # pool, inference API) Grad-CAM loads its own copy of the Keras model here in the UI process.
+    local_keras = INFERENCE_BACKEND == "keras" and not MODEL_WORKERS and not INFERENCE_API_URL
+    if local_keras:
+        model, model_version = load_model()
+        return load_gradcam(MODEL_PATH, model, model_version)
+    return load_gradcam(MODEL_PATH)
+
+@st.cache_resource
+def get_heatmap_cache():
+    from gradcam import HeatmapCache
+    return HeatmapCache("heatmap_cache")
+
+@st.cache_resource
+def load_labels():
+    from backends import load_labels
+    return load_labels("class_labels.json")
 
 # Custom CSS with enhanced styling
 def load_css():
@@ -248,25 +319,59 @@ def load_css():
     </style>
     """, unsafe_allow_html=True)
 
+@st.cache_resource
+def get_scan_pipeline():
+    # Non-UI scan path shared with benchmarks/bench_load.py; the model is only loaded on the first cache miss
+    from scan_pipeline import ScanPipeline
+    return ScanPipeline(get_prediction_cache(), get_image_store(), get_preprocessor(), load_labels(), predict_scans,
+                        refiner=get_refiner())
+
 def process_xray(image):
     try:
-        model = load_model()
-        class_labels = load_labels()
-        
-        image_array = np.array(image.convert("L"))
-        image_processed = cv2.resize(image_array, (150, 150), interpolation=cv2.INTER_LINEAR)
-        image_processed = image_processed / 255.0
-        image_processed = np.expand_dims(image_processed, axis=0)
-        image_processed = np.expand_dims(image_processed, axis=-1)
-        
-        predictions = model.predict(image_processed)
-        predicted_class_index = np.argmax(predictions[0])
-        confidence_score = np.max(predictions[0]) * 100
-        
-        return class_labels[predicted_class_index], confidence_score
+        return get_scan_pipeline().scan(image)
     except Exception as e:
+        ERRORS.inc(stage="process_xray")
+        logger.exception("Error processing image")
         st.error(f"Error processing image: {e}")
-        return None, None
+        return None, None, None
+
+def process_xray_batch(images):
+    # images is a list of (name, encoded bytes), at most get_preprocessor().max_batch_size long.
+    # Returns (prediction, confidence, image_hash) per image, all None for files that could not be decoded.
+    return get_scan_pipeline().scan_batch(images, on_decode_error=lambda name, e: st.warning(f"Skipping {name}: {e}"))
+
+def batch_scan(patient_id, key):
+    uploaded_files = st.file_uploader("📤 Upload X-ray images or .zip archives...", type=["jpg", "png", "jpeg", "zip"],
+                                      accept_multiple_files=True, key=f"{key}_files")
+    
+    if uploaded_files and st.button("Analyze Batch", key=f"{key}_analyze"):
+        total = count_upload_images(uploaded_files)
+        if total == 0:
+            st.warning("No X-ray images found in the upload.")
+            return
+        
+        progress = st.progress(0.0, text=f"🔬 Analyzing 0 of {total} scans...")
+        results = []
+        done = 0
+        try:
+            for chunk in chunked(iter_upload_images(uploaded_files), get_preprocessor().max_batch_size):
+                for (name, _), (prediction, confidence, image_hash) in zip(chunk, process_xray_batch(chunk)):
+                    if prediction:
+                        results.append((name, prediction, confidence, image_hash))
+                done += len(chunk)
+                progress.progress(done / total, text=f"🔬 Analyzing {done} of {total} scans...")
+        except Exception as e:
+            ERRORS.inc(stage="batch_scan")
+            logger.exception("Error processing batch")
+            st.error(f"Error processing batch: {e}")
+        
+        if results:
+            model_version = current_model_version()
+            save_patient_records([(patient_id, prediction, confidence, name, image_hash, model_version)
+                                  for name, prediction, confidence, image_hash in results])
+            st.success(f"Batch complete! {len(results)} of {total} scans analyzed and queued for specialist review.")
+            st.dataframe([{"Image": name, "Detection Result": prediction, "Confidence (%)": round(confidence, 2)}
+                          for name, prediction, confidence, _ in results], use_container_width=True)
 
 def landing_page():
     st.markdown('<div class="header"><h1>🫁 PneumoScan AI</h1><p style="font-size:1.2rem">Advanced AI Lung Analysis Platform</p></div>', unsafe_allow_html=True)
@@ -386,6 +491,12 @@ def navbar():
         cols = st.columns(3)
         
         if "logged_in" in st.session_state and st.session_state["logged_in"]:
+            if is_admin(st.session_state["user"]):
+                with cols[1]:
+                    showing_admin = st.session_state.get("show_admin", False)
+                    if st.button("Dashboard" if showing_admin else "Metrics", key="navbar_admin"):
+                        st.session_state["show_admin"] = not showing_admin
+                        st.rerun()
             with cols[2]:
                 if st.button("Logout"):
                     logout()
@@ -400,6 +511,10 @@ def navbar():
                     st.session_state["show_login"] = False
 
 def logout():
+    user = st.session_state.get("user")
+    if user and user["role"] == "doctor":
+        # Unreviewed cases go back to the queue instead of waiting out the claim lease
+        release_claims(user["id"])
     for key in list(st.session_state.keys()):
         del st.session_state[key]
     st.rerun()
@@ -412,12 +527,162 @@ def go_home():
         st.session_state["show_signup"] = False
         st.rerun()
 
+# Record queries are cached across sessions. The write generation from db.py is part of the
+# cache key, so any save/update in this process invalidates them; the TTL bounds staleness
+# for writes made by other processes (score.py, rescore.py).
+RECORDS_CACHE_TTL = 30
+
+@st.cache_data(ttl=RECORDS_CACHE_TTL, max_entries=1000, show_spinner=False)
+def cached_patient_records(generation, patient_id=None, status=None, limit=None, before=None):
+    return get_patient_records(patient_id=patient_id, status=status, limit=limit, before=before)
+
+@st.cache_data(ttl=RECORDS_CACHE_TTL, max_entries=1000, show_spinner=False)
+def cached_record_count(generation, patient_id=None, status=None):
+    return count_patient_records(patient_id=patient_id, status=status)
+
+# Keyset pagination: each list keeps a stack of (created_at, id) cursors in session state
+PAGE_SIZE = 20
+# Cases each doctor claims from the head of the priority queue (see db.claim_review_cases)
+REVIEW_BATCH = int(os.environ.get("PNEUMOSCAN_REVIEW_BATCH", "5"))
+
+def get_page(key, page_size=PAGE_SIZE, **filters):
+    cursors = st.session_state.setdefault(f"{key}_cursors", [None])
+    records = cached_patient_records(records_generation(), limit=page_size + 1, before=cursors[-1], **filters)
+    if not records and len(cursors) > 1:
+        # The page emptied (e.g. its cases were all reviewed), start again from the newest
+        del cursors[1:]
+        records = cached_patient_records(records_generation(), limit=page_size + 1, **filters)
+    return records[:page_size], len(records) > page_size
+
+def show_thumbnail(image_hash):
+    # Small JPEG from the image store; records saved before the store existed have no image
+    if image_hash and get_image_store().exists(image_hash):
+        st.image(get_image_store().thumbnail_path(image_hash), width=128)
+
+def page_nav(key, records, has_more, scope="app"):
+    # Lists rendered inside a fragment pass scope="fragment" so paging only redraws that list
+    cursors = st.session_state[f"{key}_cursors"]
+    col1, col2 = st.columns(2)
+    with col1:
+        if len(cursors) > 1 and st.button("← Newer", key=f"{key}_newer"):
+            cursors.pop()
+            st.rerun(scope=scope)
+    with col2:
+        if has_more and st.button("Older →", key=f"{key}_older"):
+            cursors.append((records[-1][8], records[-1][0]))
+            st.rerun(scope=scope)
+
+@st.fragment
+def health_timeline(patient_id):
+    records, has_more = get_page("timeline", patient_id=patient_id)
+    
+    if not records:
+        st.info("Your health timeline is empty. Upload your first scan to begin tracking your respiratory health.")
+    else:
+        for record in records:
+            record_id, patient_id, image_path, prediction, confidence, status, notes, prescription, created_at, patient_name, username, image_hash = record
+            
+            st.markdown(f'<div class="record-item">', unsafe_allow_html=True)
+            col1, col2 = st.columns([1, 2])
+            
+            with col1:
+                show_thumbnail(image_hash)
+                st.write(f"**Date:** {created_at[:16]}")
+                st.write(f"**Diagnosis:** {prediction}")
+                st.write(f"**Confidence:** {float(confidence):.2f}%")
+                if status == "Pending":
+                    st.markdown(f'<span class="status-pending">⏳ Specialist Review Pending</span>', unsafe_allow_html=True)
+                else:
+                    st.markdown(f'<span class="status-reviewed">✅ Expert Verified</span>', unsafe_allow_html=True)
+            
+            with col2:
+                if notes:
+                    st.write("**Specialist Assessment:**")
+                    st.write(notes)
+                if prescription:
+                    st.write("**Treatment Protocol:**")
+                    st.write(prescription)
+                if status == "Pending":
+                    st.info("A specialist is analyzing your scan. You'll be notified when complete.")
+            
+            st.markdown('</div>', unsafe_allow_html=True)
+        
+        page_nav("timeline", records, has_more, scope="fragment")
+
+@st.fragment
+def attention_map(record_id, image_hash, page_records):
+    # Generated when a doctor first opens it; the other claimed cases are computed in the same batch
+    # so opening the next case is a cache hit
+    if not image_hash:
+        return
+    if st.toggle("Show model attention", key=f"heatmap_{record_id}"):
+        from gradcam import ensure_heatmaps
+        with st.spinner("Computing Grad-CAM..."):
+            gradcam = get_gradcam()
+            cache = get_heatmap_cache()
+            path = cache.get(record_id, gradcam.model_version)
+            if path is None:
+                with STAGE_SECONDS.time(stage="gradcam"):
+                    path = ensure_heatmaps(gradcam, cache, get_image_store(), page_records).get(record_id)
+        if path:
+            st.image(path, caption="Grad-CAM: regions driving the AI assessment", width=256)
+        else:
+            st.info("The scan for this record is not in the image store.")
+
+@st.fragment
+def review_form(record_id, doctor_id):
+    # Its own fragment: typing in one case's text areas reruns only this form, not the whole page
+    doctor_notes = st.text_area("Diagnostic Notes", key=f"notes_{record_id}")
+    doctor_prescription = st.text_area("Treatment Protocol", key=f"prescription_{record_id}")
+    
+    if st.button("Submit Assessment", key=f"submit_{record_id}"):
+        if update_prescription(record_id, doctor_prescription, doctor_notes, reviewer_id=doctor_id):
+            st.success("Patient assessment submitted!")
+        else:
+            # Our claim lapsed and another specialist took the case
+            st.warning("This case has been taken over by another specialist.")
+        time.sleep(1)
+        st.rerun()
+
+@st.fragment
+def review_history():
+    reviewed_records, reviewed_has_more = get_page("reviewed", status="Reviewed")
+    
+    if not reviewed_records:
+        st.info("No completed assessments in database.")
+    else:
+        for record in reviewed_records:
+            record_id, patient_id, image_path, prediction, confidence, status, notes, prescription, created_at, patient_name, username, image_hash = record
+            
+            st.markdown(f'<div class="record-item">', unsafe_allow_html=True)
+            col1, col2 = st.columns([1, 2])
+            
+            with col1:
+                show_thumbnail(image_hash)
+                st.write(f"**Patient:** {patient_name}")
+                st.write(f"**Date:** {created_at[:16]}")
+                st.write(f"**AI Assessment:** {prediction}")
+                st.write(f"**Confidence:** {confidence:.2f}%")
+                st.markdown(f'<span class="status-reviewed">✅ Verified</span>', unsafe_allow_html=True)
+            
+            with col2:
+                if notes:
+                    st.write("**Clinical Notes:**")
+                    st.write(notes)
+                if prescription:
+                    st.write("**Treatment Protocol:**")
+                    st.write(prescription)
+            
+            st.markdown('</div>', unsafe_allow_html=True)
+        
+        page_nav("reviewed", reviewed_records, reviewed_has_more, scope="fragment")
+
 def patient_dashboard():
     st.markdown('<div class="header"><h1>Patient Health Portal</h1></div>', unsafe_allow_html=True)
     
     st.markdown(f"### Welcome, {st.session_state['user']['name']}! 👋")
     
-    tab1, tab2 = st.tabs(["Scan Analysis", "Health Timeline"])
+    tab1, tab_batch, tab2 = st.tabs(["Scan Analysis", "Batch Scan", "Health Timeline"])
     
     with tab1:
         st.markdown("## New Diagnostic Scan")
@@ -438,16 +703,26 @@ def patient_dashboard():
             
             with col2:
                 # Display analysis results in the right column
-                with st.spinner("🔬 Analyzing lung patterns..."):
-                    prediction, confidence = process_xray(image)
+                # Reruns of the same upload reuse the saved result instead of inserting a duplicate record
+                saved_scans = st.session_state.setdefault("saved_scans", {})
+                if uploaded_file.file_id in saved_scans:
+                    record_id, prediction, confidence = saved_scans[uploaded_file.file_id]
+                else:
+                    with st.spinner("🔬 Analyzing lung patterns..."):
+                        prediction, confidence, image_hash = process_xray(uploaded_file)
+                    record_id = None
                 
                 if prediction and confidence:
-                    record_id = save_patient_record(
-                        patient_id=st.session_state["user"]["id"],
-                        prediction=prediction,
-                        confidence=confidence,
-                        image_path=uploaded_file.name
-                    )
+                    if record_id is None:
+                        record_id = save_patient_record(
+                            patient_id=st.session_state["user"]["id"],
+                            prediction=prediction,
+                            confidence=confidence,
+                            image_path=uploaded_file.name,
+                            image_hash=image_hash,
+                            model_version=current_model_version()
+                        )
+                        saved_scans[uploaded_file.file_id] = (record_id, prediction, confidence)
                     
                     st.success("Analysis Complete!")
                     
@@ -470,40 +745,16 @@ def patient_dashboard():
                         3. Schedule a follow-up scan in 30 days
                         """) 
     
+    with tab_batch:
+        st.markdown("## Batch Scan")
+        st.write("Upload several X-rays or a **.zip archive** of scans to analyze them together")
+        batch_scan(st.session_state["user"]["id"], key="patient_batch")
+    
     with tab2:
         st.markdown("## Your Health Journey")
         
-        records = get_patient_records(patient_id=st.session_state["user"]["id"])
-        
-        if not records:
-            st.info("Your health timeline is empty. Upload your first scan to begin tracking your respiratory health.")
-        else:
-            for record in records:
-                record_id, patient_id, image_path, prediction, confidence, status, notes, prescription, created_at, patient_name, username = record
-                
-                st.markdown(f'<div class="record-item">', unsafe_allow_html=True)
-                col1, col2 = st.columns([1, 2])
-                
-                with col1:
-                    st.write(f"**Date:** {created_at[:16]}")
-                    st.write(f"**Diagnosis:** {prediction}")
-                    st.write(f"**Confidence:** {float(confidence):.2f}%")
-                    if status == "Pending":
-                        st.markdown(f'<span class="status-pending">⏳ Specialist Review Pending</span>', unsafe_allow_html=True)
-                    else:
-                        st.markdown(f'<span class="status-reviewed">✅ Expert Verified</span>', unsafe_allow_html=True)
-                
-                with col2:
-                    if notes:
-                        st.write("**Specialist Assessment:**")
-                        st.write(notes)
-                    if prescription:
-                        st.write("**Treatment Protocol:**")
-                        st.write(prescription)
-                    if status == "Pending":
-                        st.info("A specialist is analyzing your scan. You'll be notified when complete.")
-                
-                st.markdown('</div>', unsafe_allow_html=True)
+        health_timeline(st.session_state["user"]["id"])
+
 def doctor_dashboard():
     st.markdown('<div class="header"><h1>Specialist Dashboard</h1></div>', unsafe_allow_html=True)
     
@@ -511,68 +762,127 @@ def doctor_dashboard():
     
     st.markdown("## Priority Cases")
     
-    records = get_patient_records()
-    pending_records = [r for r in records if r[5] == "Pending"]
+    # Only this doctor's next REVIEW_BATCH cases, most urgent first; other doctors get the next ones
+    doctor_id = st.session_state["user"]["id"]
+    pending_records = claim_review_cases(doctor_id, REVIEW_BATCH)
+    pending_count = cached_record_count(records_generation(), status="Pending")
     
     if not pending_records:
-        st.success("All patient scans have been assessed. You're all caught up!")
+        if pending_count:
+            st.info(f"All {pending_count} pending cases are being reviewed by other specialists.")
+        else:
+            st.success("All patient scans have been assessed. You're all caught up!")
     else:
-        st.write(f"You have {len(pending_records)} patient cases awaiting expert review.")
+        st.write(f"You have {pending_count} patient cases awaiting expert review. "
+                 f"Showing the {len(pending_records)} most urgent assigned to you.")
         
+        page_images = [(record[0], record[11]) for record in pending_records]
         for record in pending_records:
-            record_id, patient_id, image_path, prediction, confidence, status, notes, prescription, created_at, patient_name, username = record
+            record_id, patient_id, image_path, prediction, confidence, status, notes, prescription, created_at, patient_name, username, image_hash = record
             
             st.markdown(f'<div class="record-item">', unsafe_allow_html=True)
             col1, col2 = st.columns([1, 2])
             
             with col1:
+                show_thumbnail(image_hash)
                 st.write(f"**Patient:** {patient_name}")
                 st.write(f"**Date:** {created_at[:16]}")
                 st.write(f"**AI Assessment:** {prediction}")
                 st.write(f"**Confidence:** {confidence:.2f}%")
+                attention_map(record_id, image_hash, page_images)
             
             with col2:
                 st.write("**Clinical Assessment:**")
-                doctor_notes = st.text_area("Diagnostic Notes", key=f"notes_{record_id}")
-                doctor_prescription = st.text_area("Treatment Protocol", key=f"prescription_{record_id}")
-                
-                if st.button("Submit Assessment", key=f"submit_{record_id}"):
-                    update_prescription(record_id, doctor_prescription, doctor_notes)
-                    st.success("Patient assessment submitted!")
-                    time.sleep(1)
-                    st.rerun()
+                review_form(record_id, doctor_id)
             
             st.markdown('</div>', unsafe_allow_html=True)
     
-    st.markdown("## Patient History")
+    with st.expander("📦 Bulk Intake"):
+        st.write("Analyze a batch of X-rays or a **.zip archive** of studies on behalf of a patient")
+        patients = get_patients()
+        if not patients:
+            st.info("No patient profiles registered yet.")
+        else:
+            patient = st.selectbox("Patient", patients, format_func=lambda p: f"{p[1]} ({p[2]})", key="bulk_patient")
+            batch_scan(patient[0], key="doctor_batch")
     
-    reviewed_records = [r for r in records if r[5] == "Reviewed"]
+    st.markdown("## Patient History")
     
-    if not reviewed_records:
-        st.info("No completed assessments in database.")
+    review_history()
+
+def is_admin(user):
+    return user["role"] == "doctor" and ("*" in ADMIN_USERS or user["username"] in ADMIN_USERS)
+
+def latency_rows(histogram, label):
+    # One row per label value with count, mean and estimated percentiles in milliseconds
+    rows = []
+    for labels in histogram.label_values():
+        _, total, count = histogram.snapshot(**labels)
+        if not count:
+            continue
+        row = {label: labels[label], "Count": count, "Mean (ms)": round(total / count * 1000, 2)}
+        for q in (0.5, 0.95, 0.99):
+            row[f"p{int(q * 100)} (ms)"] = round(histogram.quantile(q, **labels) * 1000, 2)
+        rows.append(row)
+    return sorted(rows, key=lambda row: row["Count"], reverse=True)
+
+def format_ms(seconds):
+    # quantile() returns None for a histogram with no observations
+    return f"{seconds * 1000:.1f} ms" if seconds is not None else "—"
+
+@st.fragment(run_every=5)
+def live_metrics():
+    cache_lookups = metrics.REGISTRY.get("pneumoscan_prediction_cache_lookups_total")
+    hits, misses = cache_lookups.value(result="hit"), cache_lookups.value(result="miss")
+    # With model worker processes, requests wait in the workers' rings rather than the engine queue
+    queue_depth = metrics.REGISTRY.get("pneumoscan_worker_pool_in_flight" if MODEL_WORKERS else "pneumoscan_inference_queue_depth")
+    batch_sizes = metrics.REGISTRY.get("pneumoscan_inference_batch_size")
+    queue_wait = metrics.REGISTRY.get("pneumoscan_inference_queue_wait_seconds")
+    predict_seconds = metrics.REGISTRY.get("pneumoscan_model_predict_seconds")
+    query_seconds = metrics.REGISTRY.get("pneumoscan_db_query_seconds")
+    pool_wait = metrics.REGISTRY.get("pneumoscan_db_pool_wait_seconds")
+    
+    col1, col2, col3, col4, col5 = st.columns(5)
+    col1.metric("Scans Processed", STAGE_SECONDS.snapshot(stage="total")[2])
+    col2.metric("Cache Hit Rate", f"{hits / (hits + misses):.1%}" if hits + misses else "—")
+    col3.metric("Inference Queue", queue_depth.value() if queue_depth else 0)
+    col4.metric("Records Awaiting Commit", metrics.REGISTRY.get("pneumoscan_db_writer_pending").value())
+    col5.metric("Errors", sum(ERRORS.value(**labels) for labels in ERRORS.label_values()))
+    
+    st.markdown("### Scan Pipeline Stages")
+    st.dataframe(latency_rows(STAGE_SECONDS, "stage"), use_container_width=True)
+    
+    st.markdown("### Inference Engine")
+    if batch_sizes is None or not batch_sizes.snapshot()[2]:
+        st.info("No predictions have run in this process yet.")
     else:
-        for record in reviewed_records:
-            record_id, patient_id, image_path, prediction, confidence, status, notes, prescription, created_at, patient_name, username = record
-            
-            st.markdown(f'<div class="record-item">', unsafe_allow_html=True)
-            col1, col2 = st.columns([1, 2])
-            
-            with col1:
-                st.write(f"**Patient:** {patient_name}")
-                st.write(f"**Date:** {created_at[:16]}")
-                st.write(f"**AI Assessment:** {prediction}")
-                st.write(f"**Confidence:** {confidence:.2f}%")
-                st.markdown(f'<span class="status-reviewed">✅ Verified</span>', unsafe_allow_html=True)
-            
-            with col2:
-                if notes:
-                    st.write("**Clinical Notes:**")
-                    st.write(notes)
-                if prescription:
-                    st.write("**Treatment Protocol:**")
-                    st.write(prescription)
-            
-            st.markdown('</div>', unsafe_allow_html=True)
+        _, total, count = batch_sizes.snapshot()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Mean Batch Size", f"{total / count:.1f}")
+        col2.metric("Queue Wait p95", format_ms(queue_wait.quantile(0.95) if queue_wait else None))
+        col3.metric("Model Call p95", format_ms(predict_seconds.quantile(0.95)))
+    
+    st.markdown("### Database")
+    st.dataframe(latency_rows(query_seconds, "query"), use_container_width=True)
+    if pool_wait.snapshot()[2]:
+        st.caption(f"Connection pool wait p95: {pool_wait.quantile(0.95) * 1000:.2f} ms")
+    
+    errors = [{"stage": labels["stage"], "Count": ERRORS.value(**labels)} for labels in ERRORS.label_values()]
+    if errors:
+        st.markdown("### Errors")
+        st.dataframe(errors, use_container_width=True)
+
+def admin_page():
+    st.markdown('<div class="header"><h1>System Metrics</h1></div>', unsafe_allow_html=True)
+    st.write("Live latency and throughput of this app process since it started. Refreshes every 5 seconds.")
+    if METRICS_PORT:
+        st.caption(f"Prometheus endpoint: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    else:
+        st.caption("Set PNEUMOSCAN_METRICS_PORT to expose these metrics to Prometheus.")
+    
+    live_metrics()
+    
+    st.download_button("Download Prometheus Snapshot", metrics.render(), file_name="pneumoscan_metrics.txt", mime="text/plain")
 
 def main():
     load_css()
@@ -588,7 +898,9 @@ def main():
     
     if st.session_state.get("logged_in", False):
         user = st.session_state["user"]
-        if user["role"] == "patient":
+        if st.session_state.get("show_admin", False) and is_admin(user):
+            admin_page()
+        elif user["role"] == "patient":
             patient_dashboard()
         elif user["role"] == "doctor":
             doctor_dashboard()
@@ -604,6 +916,8 @@ def main():
         '<div class="footer">© 2025 PneumoScan AI | Advanced Pulmonary Diagnostics | Empowering Better Respiratory Health</div>',
         unsafe_allow_html=True,
     )
+    
+    startup_timing.mark("first_render", report=True)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
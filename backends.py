@@ -0,0 +1,89 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+BACKENDS = ("keras", "tflite", "tflite-int8")
+
+
+def load_labels(path="class_labels.json"):
+    with open(path, "r") as file:
+        return {int(k): v for k, v in json.load(file).items()}
+
+
+def exported_model_path(model_path, backend):
+    root, _ = os.path.splitext(model_path)
+    if backend == "tflite":
+        return root + ".tflite"
+    if backend == "tflite-int8":
+        return root + ".int8.tflite"
+    return model_path
+
+
+def _tflite_interpreter(path, num_threads=None):
+    # Prefer the standalone runtime so workers don't have to import all of TensorFlow
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        from tensorflow.lite import Interpreter
+    return Interpreter(model_path=path, num_threads=num_threads)
+
+
+# Wraps a TFLite interpreter behind the same predict_on_batch call the Keras model exposes
+class TFLiteModel:
+    def __init__(self, path, num_threads=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._interpreter = _tflite_interpreter(path, num_threads=num_threads)
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = int(self._input["shape"][0])
+
+    def _resize(self, batch_size):
+        if batch_size != self._batch_size:
+            shape = [batch_size] + [int(d) for d in self._input["shape"][1:]]
+            self._interpreter.resize_tensor_input(self._input["index"], shape)
+            self._interpreter.allocate_tensors()
+            self._input = self._interpreter.get_input_details()[0]
+            self._output = self._interpreter.get_output_details()[0]
+            self._batch_size = batch_size
+
+    def _quantize(self, batch):
+        dtype = self._input["dtype"]
+        if dtype == np.float32:
+            return batch.astype(np.float32, copy=False)
+        scale, zero_point = self._input["quantization"]
+        info = np.iinfo(dtype)
+        return np.clip(np.round(batch / scale + zero_point), info.min, info.max).astype(dtype)
+
+    def _dequantize(self, output):
+        if self._output["dtype"] == np.float32:
+            return output
+        scale, zero_point = self._output["quantization"]
+        return (output.astype(np.float32) - zero_point) * scale
+
+    def predict_on_batch(self, batch):
+        batch = np.asarray(batch)
+        with self._lock:
+            self._resize(batch.shape[0])
+            self._interpreter.set_tensor(self._input["index"], self._quantize(batch))
+            self._interpreter.invoke()
+            output = self._interpreter.get_tensor(self._output["index"])
+        return self._dequantize(output)
+
+    def predict(self, batch, verbose=0):
+        return self.predict_on_batch(batch)
+
+
+def load_backend(model_path="best_model.h5", backend="keras", num_threads=None):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend!r}, expected one of {BACKENDS}")
+    if backend == "keras":
+        import tensorflow as tf
+        return tf.keras.models.load_model(model_path)
+    path = exported_model_path(model_path, backend)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found, run `python export_model.py --backend {backend}` first")
+    return TFLiteModel(path, num_threads=num_threads)
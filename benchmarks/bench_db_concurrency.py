@@ -0,0 +1,138 @@
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db
+
+LABELS = ["COVID-19", "Normal", "Pneumonia-Bacterial", "Pneumonia-Viral"]
+
+
+def legacy_database(path, patients):
+    # The original app.py schema on a default rollback-journal database (no WAL, no indexes
+    # beyond the primary keys), so the baseline is not measured against db.py's setup.
+    # Returns the shared connection and the patient ids
+    conn = sqlite3.connect(path, check_same_thread=False)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS users (
+        id TEXT PRIMARY KEY, username TEXT UNIQUE NOT NULL, password TEXT NOT NULL,
+        role TEXT NOT NULL, name TEXT, email TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS patient_records (
+        id TEXT PRIMARY KEY, patient_id TEXT NOT NULL, image_path TEXT,
+        prediction TEXT, confidence REAL, status TEXT DEFAULT 'Pending',
+        notes TEXT, prescription TEXT, created_at TIMESTAMP,
+        FOREIGN KEY (patient_id) REFERENCES users (id))''')
+    patient_ids = [str(uuid.uuid4()) for _ in range(patients)]
+    c.executemany("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)",
+                  [(patient_id, f"patient{i}", "password", "patient", f"Patient {i}", None)
+                   for i, patient_id in enumerate(patient_ids)])
+    conn.commit()
+    return conn, patient_ids
+
+
+def legacy_session_ops(conn):
+    # The original app.py pattern: one module-level connection shared by every session thread
+    def save(patient_id):
+        c = conn.cursor()
+        c.execute("INSERT INTO patient_records (id, patient_id, prediction, confidence, image_path, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (str(uuid.uuid4()), patient_id, random.choice(LABELS), random.uniform(50, 100), None, datetime.now()))
+        conn.commit()
+
+    def read(patient_id):
+        c = conn.cursor()
+        c.execute("""SELECT pr.*, u.name, u.username FROM patient_records pr
+            JOIN users u ON pr.patient_id = u.id WHERE pr.patient_id = ? ORDER BY pr.created_at DESC""", (patient_id,))
+        c.fetchall()
+
+    return save, read
+
+
+def pooled_session_ops():
+    def save(patient_id):
+        db.save_patient_record(patient_id, random.choice(LABELS), random.uniform(50, 100))
+
+    def read(patient_id):
+        db.get_patient_records(patient_id=patient_id, limit=20)
+
+    return save, read
+
+
+def simulate(save, read, patient_ids, sessions, ops_per_session, write_ratio, flush=None):
+    # flush, when given, waits until every write is committed (save may only queue the row);
+    # elapsed includes it so writes/s counts committed rows
+    counts = {"writes": 0, "reads": 0, "errors": 0}
+    lock = threading.Lock()
+    barrier = threading.Barrier(sessions + 1)
+
+    def session(index):
+        rng = random.Random(index)
+        patient_id = patient_ids[index % len(patient_ids)]
+        barrier.wait()
+        for _ in range(ops_per_session):
+            is_write = rng.random() < write_ratio
+            try:
+                (save if is_write else read)(patient_id)
+                key = "writes" if is_write else "reads"
+            except sqlite3.Error:
+                key = "errors"
+            with lock:
+                counts[key] += 1
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    sessions_done = time.perf_counter()
+    if flush is not None:
+        flush()
+    counts["elapsed"] = time.perf_counter() - start
+    counts["flush"] = counts["elapsed"] - (sessions_done - start)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write throughput of the shared connection vs the connection pool")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 4, 16, 32])
+    parser.add_argument("--ops", type=int, default=200, help="Operations per simulated session")
+    parser.add_argument("--write-ratio", type=float, default=0.5)
+    parser.add_argument("--pool-size", type=int, default=db.POOL_SIZE)
+    args = parser.parse_args()
+
+    # writes/s counts committed rows; "flush ms" is how long the pooled run waited after its sessions
+    # finished for the write-behind queue to commit
+    print(f"{'mode':<8}{'sessions':>10}{'writes/s':>12}{'reads/s':>12}{'flush ms':>10}{'errors':>8}")
+    for sessions in args.sessions:
+        for mode in ("shared", "pool"):
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "bench.db")
+                if mode == "shared":
+                    conn, patient_ids = legacy_database(path, max(sessions, 1))
+                    save, read = legacy_session_ops(conn)
+                    counts = simulate(save, read, patient_ids, sessions, args.ops, args.write_ratio)
+                    conn.close()
+                else:
+                    db.use_database(path, pool_size=args.pool_size)
+                    patient_ids = []
+                    for i in range(max(sessions, 1)):
+                        db.create_user(f"patient{i}", "password", "patient", f"Patient {i}")
+                        patient_ids.append(db.authenticate(f"patient{i}", "password")["id"])
+                    save, read = pooled_session_ops()
+                    counts = simulate(save, read, patient_ids, sessions, args.ops, args.write_ratio,
+                                      flush=db.flush_records)
+                    db.use_database(db.DB_PATH)
+                print(f"{mode:<8}{sessions:>10}{counts['writes'] / counts['elapsed']:>12.1f}"
+                      f"{counts['reads'] / counts['elapsed']:>12.1f}{counts['flush'] * 1000:>10.1f}{counts['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
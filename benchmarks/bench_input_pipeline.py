@@ -0,0 +1,62 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import training
+from tensorflow.keras.preprocessing.image import ImageDataGenerator
+
+
+def generator_epoch(train_dir, batch_size):
+    # The PDD.ipynb path: flow_from_directory with per-image Python augmentation
+    datagen = ImageDataGenerator(
+        rescale=1./255, rotation_range=15, width_shift_range=0.15, height_shift_range=0.15,
+        shear_range=0.15, zoom_range=0.15, horizontal_flip=True, fill_mode='nearest')
+    generator = datagen.flow_from_directory(
+        train_dir, target_size=(training.IMG_SIZE, training.IMG_SIZE), batch_size=batch_size,
+        class_mode='categorical', shuffle=True, color_mode='grayscale')
+    return generator, len(generator), generator.samples
+
+
+def time_epochs(name, make, epochs, model=None):
+    # steps bounds an epoch of the endless generator; None runs a finite tf.data dataset to its
+    # end, which Dataset.cache() needs before it finalizes the cache for the next epoch
+    data, steps, images = make()
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        if model is not None:
+            model.fit(data, epochs=1, steps_per_epoch=steps, verbose=0)
+        elif steps is None:
+            for _ in data:
+                pass
+        else:
+            for step, _ in enumerate(data):
+                if step + 1 >= steps:
+                    break
+        elapsed = time.perf_counter() - start
+        print(f"{name:<10} epoch {epoch + 1}: {elapsed:8.2f}s {images / elapsed:10.1f} images/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Epoch time of ImageDataGenerator vs the tf.data pipeline")
+    parser.add_argument("--train-dir", default=os.path.join(training.BASE_DIR, "train"))
+    parser.add_argument("--batch-size", type=int, default=training.BATCH_SIZE)
+    parser.add_argument("--epochs", type=int, default=3, help="Epoch 1 of tf.data fills the cache, later ones read it")
+    parser.add_argument("--train", action="store_true", help="Time model.fit epochs instead of only iterating input")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        def make_tfdata():
+            dataset, labels = training.make_dataset(args.train_dir, args.batch_size, training=True, cache_dir=cache_dir)
+            return dataset, None, len(labels)
+
+        model = training.build_custom_model() if args.train else None
+        time_epochs("generator", lambda: generator_epoch(args.train_dir, args.batch_size), args.epochs, model)
+        model = training.build_custom_model() if args.train else None
+        time_epochs("tf.data", make_tfdata, args.epochs, model)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db
+from backends import BACKENDS, exported_model_path, load_backend, load_labels
+from bench_preprocess import synthetic_xray
+from image_store import ImageStore
+from prediction_cache import PredictionCache, file_version
+from preprocessing import Preprocessor
+from scan_pipeline import ScanPipeline, build_refiner
+
+LABELS = ["COVID-19", "Normal", "Pneumonia-Bacterial", "Pneumonia-Viral"]
+PASSWORD = "password"
+# Rows per dashboard page, as in app.py (page size + 1 to detect a next page)
+PAGE_LIMIT = 21
+
+
+def seed(records, patients, doctors, pending_ratio, seed_value=0):
+    # Users and historical records written through db.py, so the schema, indexes and review
+    # priorities match what the app creates
+    rng = random.Random(seed_value)
+    password = db.hash_password(PASSWORD)
+    users = [(str(uuid.uuid4()), f"loadpatient{i}", password, "patient", f"Patient {i}", f"loadpatient{i}@example.com")
+             for i in range(patients)]
+    users += [(str(uuid.uuid4()), f"loaddoctor{i}", password, "doctor", f"Doctor {i}", f"loaddoctor{i}@example.com")
+              for i in range(doctors)]
+    db.write(lambda conn: conn.executemany("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)", users), name="seed_users")
+    patient_ids = [user[0] for user in users[:patients]]
+    start = datetime.now() - timedelta(seconds=30 * records)
+    chunk = 50000
+    for offset in range(0, records, chunk):
+        rows = []
+        for i in range(offset, min(offset + chunk, records)):
+            pending = rng.random() < pending_ratio
+            prediction, confidence = rng.choice(LABELS), rng.uniform(50, 100)
+            created_at = start + timedelta(seconds=30 * i)
+            priority = db.review_priority(prediction, confidence)
+            rows.append((str(uuid.uuid4()), rng.choice(patient_ids), prediction, confidence, f"scan_{i}.jpg",
+                         created_at, priority, db.queue_rank(priority, created_at),
+                         "Pending" if pending else "Reviewed", None if pending else "Reviewed", None))
+        db.write(lambda conn: conn.executemany(
+            """INSERT INTO patient_records (id, patient_id, prediction, confidence, image_path, created_at, priority,
+               queue_rank, status, notes, prescription) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows),
+            name="seed_records")
+
+
+# Builds the same ScanPipeline app.py's process_xray runs, on the in-process engine, model worker
+# processes or the inference API, with optional low-confidence refinement
+class Scanner:
+    def __init__(self, workdir, model_path, labels_path, backend, workers=0, api_url=None,
+                 refine_below=0, tta=True, tta_shift=8, ensemble_models=()):
+        class_labels = load_labels(labels_path)
+        self.client = self.engine = None
+        # As in app.py, the version is the hash of the model file the engine loaded
+        self.loaded_version = None if api_url else file_version(exported_model_path(model_path, backend))
+        if api_url:
+            from api_client import InferenceClient
+            self.client = InferenceClient(api_url)
+        elif workers:
+            from worker_pool import WorkerPool
+            self.engine = WorkerPool(model_path, backend, num_workers=workers, num_classes=len(class_labels),
+                                     max_batch_size=16)
+        else:
+            from inference import InferenceEngine
+            self.engine = InferenceEngine(load_backend(model_path, backend), max_batch_size=16, max_wait_ms=10)
+        cache = PredictionCache(os.path.join(workdir, "prediction_cache.db"), version_fn=self.model_version,
+                                max_entries=10000)
+        refiner = build_refiner(self.predict_views, refine_below, tta=tta, shift=tta_shift,
+                                ensemble_models=ensemble_models, backend=backend)
+        self.pipeline = ScanPipeline(cache, ImageStore(os.path.join(workdir, "image_store")),
+                                     Preprocessor(size=150, max_batch_size=16), class_labels, self.predict_scans,
+                                     refiner=refiner)
+
+    def predict_scans(self, pixels, batch):
+        if self.client:
+            return self.client.predict_pixels(pixels)
+        return self.engine.predict_many(batch)
+
+    def predict_views(self, views):
+        if self.client:
+            return np.stack(self.client.predict_pixels(np.rint(views[..., 0] * 255).astype(np.uint8)))
+        return self.engine.predict_batch(views)
+
+    def model_version(self):
+        return self.client.model_version() if self.client else self.loaded_version
+
+    def scan(self, data):
+        return self.pipeline.scan(data)
+
+    def close(self):
+        if self.engine is not None:
+            self.engine.shutdown()
+
+
+# Per-operation latencies and failures, shared by all simulated sessions
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.events = Counter()
+        self.first_errors = {}
+        self._lock = threading.Lock()
+
+    def timed(self, op, fn, *args, **kwargs):
+        # Returns fn's result, or None after recording the exception as an error of op
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            with self._lock:
+                self.errors[op] += 1
+                self.first_errors.setdefault(op, f"{type(e).__name__}: {e}")
+            return None
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies[op].append(elapsed)
+        return result
+
+    def count(self, event):
+        with self._lock:
+            self.events[event] += 1
+
+    def report(self, elapsed):
+        operations = []
+        for op in sorted(set(self.latencies) | set(self.errors)):
+            latencies = np.array(self.latencies[op]) * 1000
+            total = len(latencies) + self.errors[op]
+            operation = {"operation": op, "count": len(latencies), "errors": self.errors[op],
+                         "error_rate": self.errors[op] / total, "per_sec": len(latencies) / elapsed}
+            if len(latencies):
+                operation["latency_ms"] = {"p50": float(np.percentile(latencies, 50)),
+                                           "p95": float(np.percentile(latencies, 95)),
+                                           "p99": float(np.percentile(latencies, 99)),
+                                           "max": float(latencies.max())}
+            if op in self.first_errors:
+                operation["first_error"] = self.first_errors[op]
+            operations.append(operation)
+        return operations
+
+
+def think(rng, think_time, stop):
+    # Exponentially distributed pause between a user's actions; returns early on stop
+    if think_time > 0:
+        stop.wait(rng.expovariate(1.0 / think_time))
+
+
+def patient_session(index, scanner, images, recorder, stop, think_time):
+    # Log in, then repeatedly upload a scan and check the health timeline
+    rng = random.Random(index)
+    user = recorder.timed("authenticate", db.authenticate, f"loadpatient{index}", PASSWORD)
+    if user is None:
+        return
+    while not stop.is_set():
+        result = recorder.timed("process_xray", scanner.scan, rng.choice(images))
+        if result is not None:
+            prediction, confidence, image_hash = result
+            recorder.timed("save_patient_record", db.save_patient_record, user["id"], prediction, confidence,
+                           image_hash=image_hash, model_version=scanner.model_version())
+        recorder.timed("patient_timeline", db.get_patient_records, patient_id=user["id"], limit=PAGE_LIMIT)
+        think(rng, think_time, stop)
+
+
+def doctor_session(index, review_batch, recorder, stop, think_time):
+    # Log in, then repeatedly open the review queue, assess the most urgent case and browse history
+    rng = random.Random(1_000_000 + index)
+    user = recorder.timed("authenticate", db.authenticate, f"loaddoctor{index}", PASSWORD)
+    if user is None:
+        return
+    try:
+        while not stop.is_set():
+            records = recorder.timed("claim_review_cases", db.claim_review_cases, user["id"], review_batch)
+            recorder.timed("count_pending", db.count_patient_records, status="Pending")
+            if records:
+                updated = recorder.timed("update_prescription", db.update_prescription, records[0][0],
+                                         "Load test protocol", "Load test assessment", reviewer_id=user["id"])
+                if updated is False:
+                    recorder.count("review_conflicts")
+                else:
+                    recorder.count("reviews")
+            recorder.timed("review_history", db.get_patient_records, status="Reviewed", limit=PAGE_LIMIT)
+            think(rng, think_time, stop)
+    finally:
+        db.release_claims(user["id"])
+
+
+def run(scanner, images, patients, doctors, duration, think_time, review_batch):
+    recorder = Recorder()
+    stop = threading.Event()
+    threads = [threading.Thread(target=patient_session, args=(i, scanner, images, recorder, stop, think_time),
+                                name=f"patient-{i}") for i in range(patients)]
+    threads += [threading.Thread(target=doctor_session, args=(i, review_batch, recorder, stop, think_time),
+                                 name=f"doctor-{i}") for i in range(doctors)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    # Scans saved during the run count only once they are committed
+    recorder.timed("flush_records", db.flush_records)
+    return recorder, time.perf_counter() - start
+
+
+def check(operations, max_error_rate=None, max_p95_ms=None):
+    # Returns human-readable capacity failures for the deployment gate
+    failures = []
+    for operation in operations:
+        if max_error_rate is not None and operation["error_rate"] > max_error_rate:
+            failures.append(f"{operation['operation']}: error rate {operation['error_rate']:.2%}")
+        p95 = operation.get("latency_ms", {}).get("p95")
+        if max_p95_ms is not None and p95 is not None and p95 > max_p95_ms:
+            failures.append(f"{operation['operation']}: p95 {p95:.1f} ms")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the app's scan and review paths with simulated patients and doctors")
+    parser.add_argument("--patients", type=int, default=16, help="Concurrent simulated patient sessions")
+    parser.add_argument("--doctors", type=int, default=4, help="Concurrent simulated doctor sessions")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds of load")
+    parser.add_argument("--think-time", type=float, default=1.0, help="Mean seconds between a user's actions (0: none)")
+    parser.add_argument("--records", type=int, default=200_000, help="Historical records seeded before the run")
+    parser.add_argument("--pending-ratio", type=float, default=0.05)
+    parser.add_argument("--review-batch", type=int, default=5, help="Cases each doctor claims, like PNEUMOSCAN_REVIEW_BATCH")
+    parser.add_argument("--images", type=int, default=256, help="Distinct synthetic X-rays; repeats hit the prediction cache")
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--workdir", help="Keep the database, image store and prediction cache here; "
+                                          "an already seeded database is reused (default: a temporary directory)")
+    parser.add_argument("--model", default="best_model.h5")
+    parser.add_argument("--labels", default="class_labels.json")
+    parser.add_argument("--backend", choices=BACKENDS, default="keras")
+    parser.add_argument("--workers", type=int, default=0, help="Model worker processes, like PNEUMOSCAN_MODEL_WORKERS")
+    parser.add_argument("--api-url", help="Classify through a running api.py instead of a local model")
+    # Refinement defaults follow the app's environment variables
+    parser.add_argument("--refine-below", type=float, default=float(os.environ.get("PNEUMOSCAN_REFINE_BELOW", "0")),
+                        help="Re-score scans below this confidence (%%) with TTA/ensemble, like PNEUMOSCAN_REFINE_BELOW")
+    parser.add_argument("--no-tta", action="store_true", default=os.environ.get("PNEUMOSCAN_TTA", "1") != "1")
+    parser.add_argument("--tta-shift", type=int, default=int(os.environ.get("PNEUMOSCAN_TTA_SHIFT", "8")))
+    parser.add_argument("--ensemble", nargs="*",
+                        default=[path.strip() for path in os.environ.get("PNEUMOSCAN_ENSEMBLE", "").split(",") if path.strip()])
+    parser.add_argument("--pool-size", type=int, default=db.POOL_SIZE)
+    parser.add_argument("--output", help="Write the report as JSON")
+    parser.add_argument("--max-error-rate", type=float, help="Exit non-zero if any operation fails more often")
+    parser.add_argument("--max-p95-ms", type=float, help="Exit non-zero if any operation's p95 latency is higher")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir or tmp
+        os.makedirs(workdir, exist_ok=True)
+        db.use_database(os.path.join(workdir, "load_test.db"), pool_size=args.pool_size)
+        if db.authenticate("loadpatient0", PASSWORD) is None:
+            start = time.perf_counter()
+            seed(args.records, args.patients, args.doctors, args.pending_ratio)
+            print(f"Seeded {args.records} records, {args.patients} patients and {args.doctors} doctors "
+                  f"in {time.perf_counter() - start:.1f}s")
+        elif (db.authenticate(f"loadpatient{args.patients - 1}", PASSWORD) is None
+              or (args.doctors and db.authenticate(f"loaddoctor{args.doctors - 1}", PASSWORD) is None)):
+            # Seeded by an earlier run, whose users and records are otherwise reused
+            parser.error(f"{workdir} was seeded with fewer users; use a new --workdir")
+
+        rng = np.random.default_rng(0)
+        images = [synthetic_xray(rng, args.size) for _ in range(args.images)]
+        scanner = Scanner(workdir, args.model, args.labels, args.backend, workers=args.workers, api_url=args.api_url,
+                          refine_below=args.refine_below, tta=not args.no_tta, tta_shift=args.tta_shift,
+                          ensemble_models=args.ensemble)
+        # One scan loads and warms the model outside the measured window
+        scanner.scan(synthetic_xray(rng, args.size))
+        print(f"{args.patients} patients and {args.doctors} doctors for {args.duration:.0f}s "
+              f"(think time {args.think_time}s), {os.cpu_count()} cores")
+        try:
+            recorder, elapsed = run(scanner, images, args.patients, args.doctors, args.duration, args.think_time,
+                                    args.review_batch)
+        finally:
+            scanner.close()
+        # Commits and closes the pool before the temporary directory is removed
+        db.use_database(db.DB_PATH)
+
+    operations = recorder.report(elapsed)
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "patients": args.patients,
+        "doctors": args.doctors,
+        "duration_seconds": round(elapsed, 3),
+        "think_time": args.think_time,
+        "records": args.records,
+        "backend": "api" if args.api_url else args.backend,
+        "workers": args.workers,
+        "refine_below": args.refine_below,
+        "cpu_count": os.cpu_count(),
+        "events": dict(recorder.events),
+        "operations": operations,
+    }
+    print(f"{'operation':<22}{'count':>8}{'per sec':>10}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for operation in operations:
+        latency = operation.get("latency_ms", {})
+        print(f"{operation['operation']:<22}{operation['count']:>8}{operation['per_sec']:>10.1f}"
+              f"{operation['error_rate']:>8.1%}{latency.get('p50', float('nan')):>10.1f}"
+              f"{latency.get('p95', float('nan')):>10.1f}{latency.get('p99', float('nan')):>10.1f}")
+    for operation in operations:
+        if "first_error" in operation:
+            print(f"{operation['operation']} first error: {operation['first_error']}", file=sys.stderr)
+    print(f"Reviews completed: {recorder.events['reviews']}, claim conflicts: {recorder.events['review_conflicts']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+
+    failures = check(operations, args.max_error_rate, args.max_p95_ms)
+    for failure in failures:
+        print(f"CAPACITY {failure}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import argparse
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backends import BACKENDS, load_backend, load_labels
+from export_model import list_dataset
+from preprocessing import IMG_SIZE, Preprocessor, decode_grayscale
+
+
+def synthetic_xray(rng, size):
+    # Smooth grayscale gradient with noise, saved as an RGB JPEG like typical uploads
+    y, x = np.mgrid[0:size, 0:size]
+    pixels = 128 + 60 * np.sin(x / 37.0) * np.cos(y / 53.0) + rng.normal(0, 12, (size, size))
+    pixels = np.clip(pixels, 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).convert("RGB").save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def legacy_preprocess(data):
+    # The original process_xray pipeline from app.py
+    image = Image.open(io.BytesIO(data))
+    image_array = np.array(image.convert("L"))
+    image_processed = cv2.resize(image_array, (150, 150), interpolation=cv2.INTER_LINEAR)
+    image_processed = image_processed / 255.0
+    image_processed = np.expand_dims(image_processed, axis=0)
+    image_processed = np.expand_dims(image_processed, axis=-1)
+    return image_processed
+
+
+def draft_preprocess_batch(preprocessor, sources, out, draft):
+    for i, source in enumerate(sources):
+        preprocessor.normalize_into(decode_grayscale(source, draft=draft), out[i, :, :, 0])
+    return out[:len(sources)]
+
+
+def pixel_diff(preprocessor, images):
+    # Model input differences between draft and full-resolution decoding
+    full = draft_preprocess_batch(preprocessor, images, np.empty((len(images), IMG_SIZE, IMG_SIZE, 1), np.float32), False)
+    draft = draft_preprocess_batch(preprocessor, images, np.empty_like(full), True)
+    legacy = np.concatenate([legacy_preprocess(d) for d in images]).astype(np.float32)
+    for name, batch in (("full", full), ("draft", draft)):
+        diff = np.abs(batch - legacy)
+        print(f"{name:<10} vs legacy input: max abs diff {diff.max():.4f}, mean {diff.mean():.5f}")
+
+
+def parity(model_path, backend, labels_path, data_dir, limit=None, batch_size=32):
+    # Predictions of the same model on full-resolution vs draft-decoded inputs of a labelled split
+    class_labels = load_labels(labels_path)
+    samples = list_dataset(data_dir, class_labels, limit=limit)
+    if not samples:
+        raise ValueError(f"No images found in {data_dir}")
+    model = load_backend(model_path, backend)
+    preprocessor = Preprocessor(max_batch_size=batch_size, pool_size=0)
+    buffer = np.empty((batch_size, IMG_SIZE, IMG_SIZE, 1), dtype=np.float32)
+    predictions = {False: [], True: []}
+    for start in range(0, len(samples), batch_size):
+        paths = [path for path, _ in samples[start:start + batch_size]]
+        for draft in predictions:
+            batch = draft_preprocess_batch(preprocessor, paths, buffer, draft)
+            predictions[draft].append(np.asarray(model.predict_on_batch(batch)))
+    y_true = np.array([label for _, label in samples])
+    full, draft = np.concatenate(predictions[False]), np.concatenate(predictions[True])
+    return {"samples": len(samples),
+            "label_agreement": float(np.mean(full.argmax(axis=1) == draft.argmax(axis=1))),
+            "accuracy_full": float(np.mean(full.argmax(axis=1) == y_true)),
+            "accuracy_draft": float(np.mean(draft.argmax(axis=1) == y_true)),
+            "max_probability_diff": float(np.abs(full - draft).max())}
+
+
+def run(name, fn, images, repeats):
+    fn(images[:1])
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(images)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = len(images) * repeats
+    print(f"{name:<10} {elapsed / total * 1000:8.3f} ms/image  peak {peak / 1024:10.1f} KiB  "
+          f"retained {sum(s.size for s in snapshot.statistics('filename')) / 1024:8.1f} KiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare legacy and batched X-ray preprocessing")
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--parity", action="store_true",
+                        help="Compare predictions on full-resolution vs draft-decoded images of --data-dir")
+    parser.add_argument("--data-dir", default=os.path.join("Processed Dataset", "val"))
+    parser.add_argument("--limit", type=int, help="Compare a fixed random subset of this many images")
+    parser.add_argument("--model", default="best_model.h5")
+    parser.add_argument("--labels", default="class_labels.json")
+    parser.add_argument("--backend", choices=BACKENDS, default="keras")
+    parser.add_argument("--min-agreement", type=float, default=0.995,
+                        help="With --parity, exit non-zero if fewer predicted labels agree")
+    args = parser.parse_args()
+
+    if args.parity:
+        result = parity(args.model, args.backend, args.labels, args.data_dir, limit=args.limit)
+        print(f"{result['samples']} images: label agreement {result['label_agreement']:.4f}, accuracy "
+              f"{result['accuracy_full']:.4f} (full) vs {result['accuracy_draft']:.4f} (draft), "
+              f"max probability diff {result['max_probability_diff']:.4f}")
+        if result["label_agreement"] < args.min_agreement:
+            print(f"Draft decoding changes {1 - result['label_agreement']:.2%} of predictions; "
+                  f"keep PNEUMOSCAN_DRAFT_DECODE off", file=sys.stderr)
+            sys.exit(1)
+        return
+
+    rng = np.random.default_rng(0)
+    images = [synthetic_xray(rng, args.size) for _ in range(args.images)]
+    preprocessor = Preprocessor(max_batch_size=args.images)
+    buffer = preprocessor.acquire()
+
+    print(f"{args.images} JPEGs of {args.size}x{args.size}, {args.repeats} repeats")
+    run("legacy", lambda batch: np.concatenate([legacy_preprocess(d) for d in batch]), images, args.repeats)
+    run("batched", lambda batch: preprocessor.preprocess_batch(batch, out=buffer), images, args.repeats)
+    run("draft", lambda batch: draft_preprocess_batch(preprocessor, batch, buffer, True), images, args.repeats)
+    pixel_diff(preprocessor, images[:8])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db
+
+LABELS = ["COVID-19", "Normal", "Pneumonia-Bacterial", "Pneumonia-Viral"]
+
+
+def create_legacy_schema(path):
+    # Schema as originally created by app.py: no indexes, rollback journal
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE users (
+        id TEXT PRIMARY KEY, username TEXT UNIQUE NOT NULL, password TEXT NOT NULL,
+        role TEXT NOT NULL, name TEXT, email TEXT)''')
+    conn.execute('''CREATE TABLE patient_records (
+        id TEXT PRIMARY KEY, patient_id TEXT NOT NULL, image_path TEXT,
+        prediction TEXT, confidence REAL, status TEXT DEFAULT 'Pending',
+        notes TEXT, prescription TEXT, created_at TIMESTAMP,
+        FOREIGN KEY (patient_id) REFERENCES users (id))''')
+    conn.commit()
+    return conn
+
+
+def seed(conn, records, patients, pending_ratio, seed_value=0):
+    rng = random.Random(seed_value)
+    patient_ids = [str(uuid.uuid4()) for _ in range(patients)]
+    conn.executemany("INSERT INTO users VALUES (?, ?, ?, 'patient', ?, ?)",
+        [(pid, f"patient{i}", db.hash_password("password"), f"Patient {i}", f"patient{i}@example.com")
+         for i, pid in enumerate(patient_ids)])
+    start = datetime(2024, 1, 1)
+    chunk = 50000
+    for offset in range(0, records, chunk):
+        rows = []
+        for i in range(offset, min(offset + chunk, records)):
+            pending = rng.random() < pending_ratio
+            rows.append((str(uuid.uuid4()), rng.choice(patient_ids), f"scan_{i}.jpg", rng.choice(LABELS),
+                         rng.uniform(50, 100), "Pending" if pending else "Reviewed",
+                         None if pending else "Reviewed", None, start + timedelta(seconds=30 * i)))
+        conn.executemany("INSERT INTO patient_records VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.commit()
+    return patient_ids
+
+
+def legacy_doctor_page(conn):
+    # Original get_patient_records() followed by doctor_dashboard's list comprehension
+    c = conn.cursor()
+    c.execute("""SELECT pr.*, u.name, u.username FROM patient_records pr
+            JOIN users u ON pr.patient_id = u.id ORDER BY pr.created_at DESC""")
+    records = c.fetchall()
+    return [r for r in records if r[5] == "Pending"]
+
+
+def legacy_patient_page(conn, patient_id):
+    c = conn.cursor()
+    c.execute("""SELECT pr.*, u.name, u.username FROM patient_records pr
+            JOIN users u ON pr.patient_id = u.id WHERE pr.patient_id = ? ORDER BY pr.created_at DESC""", (patient_id,))
+    return c.fetchall()
+
+
+def timed(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dashboard queries on a large synthetic patient_records table")
+    parser.add_argument("--records", type=int, default=1_000_000)
+    parser.add_argument("--patients", type=int, default=10_000)
+    parser.add_argument("--pending-ratio", type=float, default=0.05)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--page-size", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        conn = create_legacy_schema(path)
+        start = time.perf_counter()
+        patient_ids = seed(conn, args.records, args.patients, args.pending_ratio)
+        print(f"Seeded {args.records} records for {args.patients} patients in {time.perf_counter() - start:.1f}s")
+        patient_id = patient_ids[0]
+
+        legacy_doctor = timed(lambda: legacy_doctor_page(conn), args.repeats)
+        legacy_patient = timed(lambda: legacy_patient_page(conn, patient_id), args.repeats)
+        conn.close()
+
+        start = time.perf_counter()
+        db.use_database(path)
+        db.get_pool()
+        print(f"Built indexes and enabled WAL in {time.perf_counter() - start:.1f}s")
+
+        def doctor_page():
+            db.get_patient_records(status="Pending", limit=args.page_size + 1)
+
+        def doctor_deep_page():
+            first = db.get_patient_records(status="Pending", limit=args.page_size)
+            db.get_patient_records(status="Pending", limit=args.page_size + 1, before=(first[-1][8], first[-1][0]))
+
+        def patient_page():
+            db.get_patient_records(patient_id=patient_id, limit=args.page_size + 1)
+
+        print(f"{'query':<32}{'legacy ms':>12}{'indexed ms':>12}")
+        print(f"{'doctor pending, first page':<32}{legacy_doctor:>12.2f}{timed(doctor_page, args.repeats):>12.2f}")
+        print(f"{'doctor pending, next page':<32}{legacy_doctor:>12.2f}{timed(doctor_deep_page, args.repeats):>12.2f}")
+        print(f"{'doctor pending count':<32}{'':>12}{timed(lambda: db.count_patient_records(status='Pending'), args.repeats):>12.2f}")
+        doctors = iter(range(args.repeats))
+        print(f"{'doctor queue claim':<32}{'':>12}"
+              f"{timed(lambda: db.claim_review_cases(f'doctor{next(doctors)}', 5), args.repeats):>12.2f}")
+        print(f"{'patient timeline, first page':<32}{legacy_patient:>12.2f}{timed(patient_page, args.repeats):>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
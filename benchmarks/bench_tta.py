@@ -0,0 +1,80 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backends import BACKENDS, load_backend, load_labels
+from bench_preprocess import synthetic_xray
+from export_model import list_dataset
+from inference import InferenceEngine
+from preprocessing import Preprocessor
+from tta import Ensemble, Refiner
+
+
+def latency(fn, tensors):
+    times = []
+    for tensor in tensors:
+        start = time.perf_counter()
+        fn(tensor)
+        times.append(time.perf_counter() - start)
+    times_ms = np.array(times) * 1000
+    return np.percentile(times_ms, 50), np.percentile(times_ms, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency overhead of test-time augmentation and ensembling")
+    parser.add_argument("--model", default="best_model.h5")
+    parser.add_argument("--labels", default="class_labels.json")
+    parser.add_argument("--backend", choices=BACKENDS, default="keras")
+    parser.add_argument("--ensemble", nargs="*", default=[], help="Extra checkpoints to average with the model")
+    parser.add_argument("--data-dir", help="Labelled split (e.g. 'Processed Dataset/val') for confidence and accuracy")
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[60, 70, 80, 90])
+    args = parser.parse_args()
+
+    preprocessor = Preprocessor(max_batch_size=1, pool_size=0)
+    if args.data_dir:
+        samples = list_dataset(args.data_dir, load_labels(args.labels), limit=args.images)
+        tensors = [preprocessor.preprocess(path) for path, _ in samples]
+        y_true = np.array([label for _, label in samples])
+    else:
+        rng = np.random.default_rng(0)
+        tensors = [preprocessor.preprocess(synthetic_xray(rng, 512)) for _ in range(args.images)]
+        y_true = None
+
+    engine = InferenceEngine(load_backend(args.model, args.backend), max_batch_size=16, max_wait_ms=0)
+    ensemble = Ensemble(args.ensemble, args.backend) if args.ensemble else None
+    refiners = {"tta": Refiner(engine.predict_batch, 100, ensemble=None)}
+    if ensemble:
+        refiners["ensemble"] = Refiner(engine.predict_batch, 100, flip=False, shift=0, ensemble=ensemble)
+        refiners["tta+ensemble"] = Refiner(engine.predict_batch, 100, ensemble=ensemble)
+
+    engine.predict(tensors[0])
+    base_p50, base_p95 = latency(engine.predict, tensors)
+    print(f"{len(tensors)} scans, backend {args.backend}")
+    print(f"{'single pass':<14} p50 {base_p50:7.2f} ms  p95 {base_p95:7.2f} ms")
+    base = np.stack([engine.predict(t) for t in tensors])
+    confidence = base.max(axis=1) * 100
+
+    for name, refiner in refiners.items():
+        refiner.refine([tensors[0]])
+        p50, p95 = latency(lambda t: refiner.refine([t]), tensors)
+        print(f"{name:<14} p50 {p50:7.2f} ms  p95 {p95:7.2f} ms  ({refiner.views_per_scan} views)")
+        refined = np.stack([refiner.refine([t])[0] for t in tensors])
+        for threshold in args.thresholds:
+            # Expected per-scan cost when only scans below the threshold are refined
+            low = confidence < threshold
+            mixed = np.where(low[:, None], refined, base)
+            line = (f"  below {threshold:4.0f}%: {low.mean():6.1%} of scans refined, "
+                    f"mean latency +{low.mean() * p50:6.2f} ms")
+            if y_true is not None:
+                line += f", accuracy {np.mean(base.argmax(1) == y_true):.4f} -> {np.mean(mixed.argmax(1) == y_true):.4f}"
+            print(line)
+    engine.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backends import BACKENDS, load_backend, load_labels
+from bench_preprocess import synthetic_xray
+from inference import InferenceEngine
+from preprocessing import Preprocessor
+from worker_pool import WorkerPool
+
+
+def run(name, engine, images, sessions):
+    # Each session thread decodes and preprocesses its scan, then waits for the prediction,
+    # like concurrent Streamlit sessions calling process_xray
+    preprocessor = Preprocessor(max_batch_size=1, pool_size=0)
+
+    def scan(data):
+        return engine.predict(preprocessor.preprocess(data))
+
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        list(pool.map(scan, images[:sessions]))
+        start = time.perf_counter()
+        list(pool.map(scan, images))
+        elapsed = time.perf_counter() - start
+    print(f"{name:<18} {len(images) / elapsed:10.1f} scans/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scan throughput of the in-process engine vs model worker processes")
+    parser.add_argument("--model", default="best_model.h5")
+    parser.add_argument("--labels", default="class_labels.json")
+    parser.add_argument("--backend", choices=BACKENDS, default="keras")
+    parser.add_argument("--images", type=int, default=512)
+    parser.add_argument("--size", type=int, default=1024)
+    parser.add_argument("--sessions", type=int, default=16, help="Concurrent submitting threads")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    distinct = [synthetic_xray(rng, args.size) for _ in range(32)]
+    images = [distinct[i % len(distinct)] for i in range(args.images)]
+    print(f"{args.images} JPEGs of {args.size}x{args.size}, {args.sessions} sessions, {os.cpu_count()} cores")
+
+    engine = InferenceEngine(load_backend(args.model, args.backend), max_batch_size=16, max_wait_ms=10)
+    run("in-process", engine, images, args.sessions)
+    engine.shutdown()
+
+    num_classes = len(load_labels(args.labels))
+    for workers in args.workers:
+        pool = WorkerPool(args.model, args.backend, num_workers=workers, num_classes=num_classes, max_batch_size=16)
+        run(f"{workers} worker(s)", pool, images, args.sessions)
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
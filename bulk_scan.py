@@ -0,0 +1,46 @@
+import os
+import zipfile
+from itertools import islice
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def is_image_name(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS) and not os.path.basename(name).startswith(".")
+
+
+def _zip_members(archive):
+    return [info for info in archive.infolist() if not info.is_dir() and is_image_name(info.filename)]
+
+
+def count_upload_images(uploaded_files):
+    total = 0
+    for uploaded_file in uploaded_files:
+        if uploaded_file.name.lower().endswith(".zip"):
+            uploaded_file.seek(0)
+            with zipfile.ZipFile(uploaded_file) as archive:
+                total += len(_zip_members(archive))
+        elif is_image_name(uploaded_file.name):
+            total += 1
+    return total
+
+
+def iter_upload_images(uploaded_files):
+    # Yields (name, encoded bytes) for every image, expanding zip archives one member at a time
+    for uploaded_file in uploaded_files:
+        if uploaded_file.name.lower().endswith(".zip"):
+            uploaded_file.seek(0)
+            with zipfile.ZipFile(uploaded_file) as archive:
+                for info in _zip_members(archive):
+                    yield f"{uploaded_file.name}/{info.filename}", archive.read(info)
+        elif is_image_name(uploaded_file.name):
+            yield uploaded_file.name, uploaded_file.getvalue()
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
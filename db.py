@@ -0,0 +1,571 @@
+import atexit
+import glob
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import metrics
+
+DB_PATH = os.environ.get("PNEUMOSCAN_DB", "pneumonia_app.db")
+POOL_SIZE = int(os.environ.get("PNEUMOSCAN_DB_POOL_SIZE", "8"))
+BUSY_TIMEOUT = 5.0
+FLUSH_INTERVAL = float(os.environ.get("PNEUMOSCAN_DB_FLUSH_INTERVAL", "0.05"))
+
+logger = logging.getLogger("pneumoscan.db")
+
+QUERY_SECONDS = metrics.histogram("pneumoscan_db_query_seconds", "Time per database query or write transaction", ["query"])
+POOL_WAIT_SECONDS = metrics.histogram("pneumoscan_db_pool_wait_seconds", "Time spent waiting for a pooled connection")
+GROUP_COMMIT_ROWS = metrics.histogram("pneumoscan_db_group_commit_rows", "Rows per write-behind group commit",
+                                      buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500))
+WRITER_PENDING = metrics.gauge("pneumoscan_db_writer_pending", "Patient records queued but not yet committed")
+
+# Database setup
+def connect(path, busy_timeout=BUSY_TIMEOUT):
+    conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False)
+    # synchronous is per connection; NORMAL is durable across application crashes in WAL mode
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def add_column(c, table, column, definition):
+    # Lightweight migration for databases created before the column existed
+    if column not in {row[1] for row in c.execute(f"PRAGMA table_info({table})")}:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+INSERT_RECORD_SQL = ("INSERT INTO patient_records (id, patient_id, prediction, confidence, image_path, image_hash, "
+                     "model_version, created_at, priority, queue_rank) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+
+# Review priority = 100 * severity tier + urgency (0-99). Suspected disease is more urgent the more
+# confident the model is; a "Normal" call is more urgent the less confident it is.
+SEVERITY_TIERS = {"COVID-19": 3, "Pneumonia-Viral": 2, "Pneumonia-Bacterial": 2, "Normal": 1}
+DEFAULT_TIER = 2
+# Seconds a doctor keeps claimed cases without reviewing them before others may take them
+CLAIM_LEASE = float(os.environ.get("PNEUMOSCAN_CLAIM_LEASE", "1800"))
+
+def review_priority(prediction, confidence):
+    tier = SEVERITY_TIERS.get(prediction, DEFAULT_TIER)
+    urgency = min(99, max(0, int(confidence or 0)))
+    return tier * 100 + (99 - urgency if prediction == "Normal" else urgency)
+
+# Same formula in SQL, for backfilling rows written before the priority column existed
+_URGENCY_SQL = "MIN(99, MAX(0, CAST(COALESCE(confidence, 0) AS INTEGER)))"
+PRIORITY_SQL = ("(CASE prediction " + " ".join(f"WHEN '{label}' THEN {tier}" for label, tier in SEVERITY_TIERS.items())
+                + f" ELSE {DEFAULT_TIER} END) * 100"
+                + f" + (CASE WHEN prediction = 'Normal' THEN 99 - {_URGENCY_SQL} ELSE {_URGENCY_SQL} END)")
+
+# Aging: a pending case gains QUEUE_AGING_PER_HOUR priority points for every hour it waits, so no
+# case waits more than (399 - 100) / QUEUE_AGING_PER_HOUR hours (~30) behind newer arrivals. All
+# pending cases age at the same rate, so ordering by priority + rate * hours waited at any moment
+# equals ordering by priority - rate * hours since the epoch of created_at. That time-independent
+# value is stored as queue_rank and indexed; ties fall to the older case through created_at.
+QUEUE_AGING_PER_HOUR = 10
+_EPOCH = datetime(1970, 1, 1)
+# created_at in hours since the epoch; julianday reads the naive timestamps the same way as _EPOCH
+_HOURS_SQL = "(julianday(created_at) - 2440587.5) * 24"
+
+def queue_rank(priority, created_at):
+    return priority - QUEUE_AGING_PER_HOUR * (created_at - _EPOCH).total_seconds() / 3600
+
+def init_db(path=DB_PATH):
+    conn = connect(path)
+    # WAL lets dashboard reads proceed while a scan is being written
+    conn.execute("PRAGMA journal_mode=WAL")
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS users (
+        id TEXT PRIMARY KEY, username TEXT UNIQUE NOT NULL, password TEXT NOT NULL,
+        role TEXT NOT NULL, name TEXT, email TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS patient_records (
+        id TEXT PRIMARY KEY, patient_id TEXT NOT NULL, image_path TEXT,
+        prediction TEXT, confidence REAL, status TEXT DEFAULT 'Pending',
+        notes TEXT, prescription TEXT, created_at TIMESTAMP,
+        FOREIGN KEY (patient_id) REFERENCES users (id))''')
+    # Dashboards filter by status or patient and page newest-first; id breaks created_at ties
+    # for keyset pagination. users.username is already indexed by its UNIQUE constraint.
+    add_column(c, "patient_records", "image_hash", "TEXT")
+    # Content hash of the model file that produced prediction/confidence (see prediction_cache.file_version)
+    add_column(c, "patient_records", "model_version", "TEXT")
+    add_column(c, "patient_records", "priority", "INTEGER")
+    add_column(c, "patient_records", "queue_rank", "REAL")
+    # Review queue claims: the doctor holding a pending case and since when (see claim_review_cases)
+    add_column(c, "patient_records", "claimed_by", "TEXT")
+    add_column(c, "patient_records", "claimed_at", "TIMESTAMP")
+    c.execute(f"UPDATE patient_records SET priority = {PRIORITY_SQL} WHERE priority IS NULL")
+    c.execute(f"UPDATE patient_records SET queue_rank = priority - {QUEUE_AGING_PER_HOUR} * {_HOURS_SQL} WHERE queue_rank IS NULL")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_patient_records_status_created ON patient_records (status, created_at, id)")
+    # Partial index in queue order; only pending rows are indexed, so it stays small as reviews accumulate.
+    # It replaces the earlier index on (priority, created_at), which ignored how long a case had waited.
+    c.execute("DROP INDEX IF EXISTS idx_patient_records_review_queue")
+    c.execute("""CREATE INDEX IF NOT EXISTS idx_patient_records_review_rank
+                 ON patient_records (queue_rank DESC, id) WHERE status = 'Pending'""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_patient_records_patient_created ON patient_records (patient_id, created_at, id)")
+    conn.commit()
+    return conn
+
+# Bounded pool of connections: each session thread borrows its own connection
+# instead of interleaving cursors on one shared handle
+class ConnectionPool:
+    def __init__(self, path, size=POOL_SIZE, busy_timeout=BUSY_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.busy_timeout = busy_timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        # The first connection also creates the schema
+        self._idle.put(init_db(path))
+        self._created = 1
+
+    def acquire(self, timeout=None):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            return connect(self.path, self.busy_timeout)
+        try:
+            return self._idle.get(timeout=self.busy_timeout if timeout is None else timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f"timed out waiting for one of {self.size} pooled connections")
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        with POOL_WAIT_SECONDS.time():
+            conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    # Opened on first use so importing this module (e.g. from score.py) has no side effects
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(DB_PATH)
+        return _pool
+
+def use_database(path, pool_size=POOL_SIZE):
+    global DB_PATH, POOL_SIZE, _pool, _writer
+    if _writer is not None:
+        _writer.close()
+    with _pool_lock:
+        _writer = None
+        if _pool is not None:
+            _pool.close()
+        DB_PATH = path
+        POOL_SIZE = pool_size
+        _pool = None
+
+def connection():
+    return get_pool().connection()
+
+def is_busy_error(error):
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+def run_with_retry(fn, retries=5, backoff=0.05):
+    # sqlite's busy timeout covers most contention; this retries what still surfaces as "database is locked"
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except sqlite3.OperationalError as e:
+            if not is_busy_error(e) or attempt == retries:
+                raise
+            time.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+# Bumped by every write to patient_records so callers caching query results (app.py) can tell
+# their entries are stale; writes from other processes are only caught by the cache TTL
+_records_generation = 0
+_generation_lock = threading.Lock()
+
+def records_generation():
+    return _records_generation
+
+def bump_records_generation():
+    global _records_generation
+    with _generation_lock:
+        _records_generation += 1
+
+def write(fn, name="write"):
+    # Runs fn(conn) as one transaction on a pooled connection, retrying while the database is locked
+    def attempt():
+        with connection() as conn:
+            with conn:
+                return fn(conn)
+    try:
+        with QUERY_SECONDS.time(query=name):
+            return run_with_retry(attempt)
+    finally:
+        bump_records_generation()
+
+# Rows a group commit could not write after every retry go to a spill file next to the database
+# instead of being dropped. Spilled rows are replayed when a writer starts and after its next
+# successful commit; replays use INSERT OR IGNORE, so replaying a row twice is harmless.
+REPLAY_RECORD_SQL = INSERT_RECORD_SQL.replace("INSERT INTO", "INSERT OR IGNORE INTO", 1)
+
+def spill_path(path):
+    return path + "-spill.jsonl"
+
+# Write-behind queue for new patient_records rows. save_patient_record returns as soon as the row
+# is queued; a background thread group-commits queued rows every FLUSH_INTERVAL seconds (or every
+# max_batch rows). Rows are durable once flushed (committed, or spilled if the database keeps
+# failing): flush() waits for that, reads flush first so sessions always see their own records,
+# and the queue is drained at interpreter exit.
+class RecordWriter:
+    def __init__(self, flush_interval=FLUSH_INTERVAL, max_batch=500, max_pending=10000, spill_file=None):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.spill_file = spill_file or spill_path(DB_PATH)
+        self._spilled = os.path.exists(self.spill_file) or bool(glob.glob(glob.escape(self.spill_file) + ".*.replay"))
+        # Bounded so a stalled database applies backpressure instead of growing without limit
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="record-writer", daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    def put(self, row):
+        if self._closed:
+            raise RuntimeError("record writer is closed")
+        with self._lock:
+            self._pending += 1
+        self._queue.put(("row", row))
+        # Invalidate now: the next cached read misses and flushes this row before querying
+        bump_records_generation()
+
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def flush(self, timeout=None):
+        if self.pending() == 0:
+            return True
+        done = threading.Event()
+        self._queue.put(("flush", done))
+        return done.wait(timeout)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(("stop", None))
+        self._worker.join()
+
+    def _insert(self, rows, attempts=10):
+        for attempt in range(attempts):
+            try:
+                write(lambda conn: conn.executemany(INSERT_RECORD_SQL, rows), name="group_commit")
+                GROUP_COMMIT_ROWS.observe(len(rows))
+                if self._spilled:
+                    self._replay_spill()
+                return
+            except sqlite3.Error:
+                logger.exception("Group commit of %d patient records failed (attempt %d)", len(rows), attempt + 1)
+                time.sleep(min(2 ** attempt * 0.1, 5.0))
+        metrics.ERRORS.inc(len(rows), stage="db_write")
+        self._spill(rows)
+
+    def _spill(self, rows):
+        try:
+            with open(self.spill_file, "a") as f:
+                for row in rows:
+                    f.write(json.dumps([str(value) if isinstance(value, datetime) else value for value in row]) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError:
+            logger.exception("Dropped %d patient records, spill file %s not writable: %s",
+                             len(rows), self.spill_file, [row[0] for row in rows])
+            return
+        self._spilled = True
+        logger.error("Spilled %d patient records to %s after repeated commit failures", len(rows), self.spill_file)
+
+    def _replay_spill(self):
+        # Renaming takes the file over, so rows spilled meanwhile start a new one; *.replay files
+        # left by an interrupted replay are picked up too
+        try:
+            os.replace(self.spill_file, f"{self.spill_file}.{os.getpid()}.{uuid.uuid4().hex}.replay")
+        except FileNotFoundError:
+            pass
+        for path in sorted(glob.glob(glob.escape(self.spill_file) + ".*.replay")):
+            rows = []
+            with open(path) as f:
+                for line in f:
+                    try:
+                        rows.append(tuple(json.loads(line)))
+                    except ValueError:
+                        # A line cut short by a crash while spilling
+                        logger.error("Skipping unreadable line in %s: %r", path, line)
+            try:
+                write(lambda conn: conn.executemany(REPLAY_RECORD_SQL, rows), name="replay_spill")
+            except sqlite3.Error:
+                logger.exception("Replaying %d spilled patient records from %s failed", len(rows), path)
+                return
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            logger.info("Replayed %d spilled patient records from %s", len(rows), path)
+        self._spilled = False
+
+    def _run(self):
+        if self._spilled:
+            self._replay_spill()
+        while True:
+            kind, item = self._queue.get()
+            rows, waiters, stop = [], [], False
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if kind == "row":
+                    rows.append(item)
+                elif kind == "flush":
+                    waiters.append(item)
+                    break
+                else:
+                    stop = True
+                    break
+                remaining = deadline - time.monotonic()
+                if len(rows) >= self.max_batch or remaining <= 0:
+                    break
+                try:
+                    kind, item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if rows:
+                self._insert(rows)
+                with self._lock:
+                    self._pending -= len(rows)
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                return
+
+_writer = None
+
+def get_record_writer():
+    global _writer
+    with _pool_lock:
+        if _writer is None:
+            _writer = RecordWriter()
+        return _writer
+
+def flush_records(timeout=None):
+    return _writer.flush(timeout) if _writer is not None else True
+
+WRITER_PENDING.set_function(lambda: _writer.pending() if _writer is not None else 0)
+
+# Authentication functions
+def hash_password(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+def create_user(username, password, role, name="", email=""):
+    user_id = str(uuid.uuid4())
+    try:
+        write(lambda conn: conn.execute("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)",
+            (user_id, username, hash_password(password), role, name, email)), name="create_user")
+        return True
+    except sqlite3.IntegrityError:
+        return False
+
+def authenticate(username, password):
+    with QUERY_SECONDS.time(query="authenticate"), connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT * FROM users WHERE username = ? AND password = ?",
+                  (username, hash_password(password)))
+        user = c.fetchone()
+    return {"id": user[0], "username": user[1], "role": user[3],
+            "name": user[4], "email": user[5]} if user else None
+
+def save_patient_record(patient_id, prediction, confidence, image_path=None, image_hash=None, model_version=None):
+    # Queued on the write-behind RecordWriter; the id is valid immediately
+    record_id = str(uuid.uuid4())
+    now = datetime.now()
+    priority = review_priority(prediction, confidence)
+    get_record_writer().put((record_id, patient_id, prediction, confidence, image_path, image_hash, model_version, now,
+                             priority, queue_rank(priority, now)))
+    return record_id
+
+def save_patient_records(records):
+    # Bulk insert of (patient_id, prediction, confidence, image_path, image_hash, model_version) rows
+    # in a single transaction
+    now = datetime.now()
+    rows = []
+    for patient_id, prediction, confidence, image_path, image_hash, model_version in records:
+        priority = review_priority(prediction, confidence)
+        rows.append((str(uuid.uuid4()), patient_id, prediction, confidence, image_path, image_hash, model_version, now,
+                     priority, queue_rank(priority, now)))
+    write(lambda conn: conn.executemany(INSERT_RECORD_SQL, rows), name="save_patient_records")
+    return [row[0] for row in rows]
+
+def get_recorded_image_paths(patient_id):
+    flush_records()
+    with QUERY_SECONDS.time(query="get_recorded_image_paths"), connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT image_path FROM patient_records WHERE patient_id = ? AND image_path IS NOT NULL", (patient_id,))
+        return {row[0] for row in c.fetchall()}
+
+def get_patients():
+    with QUERY_SECONDS.time(query="get_patients"), connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT id, name, username FROM users WHERE role = 'patient' ORDER BY name")
+        return c.fetchall()
+
+def update_prescription(record_id, prescription, notes, reviewer_id=None):
+    # With reviewer_id, only succeeds while the case is still pending and unclaimed or claimed by that
+    # reviewer, so two doctors cannot both review it; returns whether the record was updated
+    query = ("UPDATE patient_records SET prescription = ?, notes = ?, status = 'Reviewed', claimed_by = NULL, "
+             "claimed_at = NULL WHERE id = ?")
+    params = [prescription, notes, record_id]
+    if reviewer_id:
+        query += " AND status = 'Pending' AND (claimed_by IS NULL OR claimed_by = ?)"
+        params.append(reviewer_id)
+    return write(lambda conn: conn.execute(query, params).rowcount, name="update_prescription") > 0
+
+def get_stale_records(model_version, after_id="", limit=256, status=None):
+    # Records with a stored image that were scored by a different model, walked in id order
+    # so a re-scoring job can resume from the last id it finished
+    query = """SELECT id, image_hash FROM patient_records
+            WHERE id > ? AND image_hash IS NOT NULL AND (model_version IS NULL OR model_version != ?)"""
+    params = [after_id, model_version]
+    if status:
+        query += " AND status = ?"
+        params.append(status)
+    query += " ORDER BY id LIMIT ?"
+    params.append(limit)
+    flush_records()
+    with QUERY_SECONDS.time(query="get_stale_records"), connection() as conn:
+        return conn.execute(query, params).fetchall()
+
+def update_record_predictions(updates, status=None):
+    # (prediction, confidence, model_version, record_id) rows, applied in one transaction; the
+    # review priority and queue rank follow the new prediction. With status, records whose status
+    # has changed since they were selected are left alone.
+    query = f"""UPDATE patient_records SET prediction = ?, confidence = ?, model_version = ?, priority = ?,
+            queue_rank = ? - {QUEUE_AGING_PER_HOUR} * {_HOURS_SQL} WHERE id = ?"""
+    rows = []
+    for prediction, confidence, model_version, record_id in updates:
+        priority = review_priority(prediction, confidence)
+        rows.append((prediction, confidence, model_version, priority, priority, record_id) + ((status,) if status else ()))
+    if status:
+        query += " AND status = ?"
+    write(lambda conn: conn.executemany(query, rows), name="update_record_predictions")
+
+RECORD_COLUMNS = """pr.id, pr.patient_id, pr.image_path, pr.prediction, pr.confidence, pr.status,
+                   pr.notes, pr.prescription, pr.created_at, u.name, u.username, pr.image_hash"""
+
+def format_records(records):
+    formatted_records = []
+    for record in records:
+        record = list(record)
+        record[4] = float(record[4]) if not isinstance(record[4], bytes) else float.fromhex(record[4].hex())
+        formatted_records.append(tuple(record))
+    return formatted_records
+
+def get_patient_records(patient_id=None, status=None, limit=None, before=None):
+    # before is the (created_at, id) of the last record on the previous page (keyset pagination)
+    query = f"""SELECT {RECORD_COLUMNS}
+            FROM patient_records pr
+            JOIN users u ON pr.patient_id = u.id"""
+    conditions, params = [], []
+    if patient_id:
+        conditions.append("pr.patient_id = ?")
+        params.append(patient_id)
+    if status:
+        conditions.append("pr.status = ?")
+        params.append(status)
+    if before:
+        conditions.append("(pr.created_at, pr.id) < (?, ?)")
+        params.extend(before)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY pr.created_at DESC, pr.id DESC"
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    flush_records()
+    with QUERY_SECONDS.time(query="get_patient_records"), connection() as conn:
+        c = conn.cursor()
+        c.execute(query, params)
+        records = c.fetchall()
+    return format_records(records)
+
+def count_patient_records(patient_id=None, status=None):
+    query = "SELECT COUNT(*) FROM patient_records"
+    conditions, params = [], []
+    if patient_id:
+        conditions.append("patient_id = ?")
+        params.append(patient_id)
+    if status:
+        conditions.append("status = ?")
+        params.append(status)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    flush_records()
+    with QUERY_SECONDS.time(query="count_patient_records"), connection() as conn:
+        return conn.execute(query, params).fetchone()[0]
+
+# Review queue: pending records in (queue_rank DESC, id) order, i.e. by priority plus the aging
+# credit for the time waited (see QUEUE_AGING_PER_HOUR). Each doctor claims the next few cases for CLAIM_LEASE
+# seconds so concurrent doctors work on disjoint cases. Claim columns are not part of any cached
+# read, so these writes leave records_generation alone.
+def claim_review_cases(doctor_id, limit, lease=CLAIM_LEASE):
+    # Renews the doctor's current claims, tops them up to `limit` from the head of the queue and
+    # returns the claimed records (same columns as get_patient_records) in queue order. The first
+    # UPDATE takes the write lock, so the whole claim is atomic against other doctors.
+    def claim():
+        now = datetime.now()
+        with connection() as conn:
+            with conn:
+                held = conn.execute("UPDATE patient_records SET claimed_at = ? WHERE status = 'Pending' AND claimed_by = ?",
+                                    (now, doctor_id)).rowcount
+                if held < limit:
+                    conn.execute("""UPDATE patient_records SET claimed_by = ?, claimed_at = ?
+                        WHERE id IN (SELECT id FROM patient_records INDEXED BY idx_patient_records_review_rank
+                                     WHERE status = 'Pending' AND (claimed_by IS NULL OR claimed_at < ?)
+                                     ORDER BY queue_rank DESC, id LIMIT ?)""",
+                                 (doctor_id, now, now - timedelta(seconds=lease), limit - held))
+                return conn.execute(f"""SELECT {RECORD_COLUMNS}
+                    FROM patient_records pr
+                    JOIN users u ON pr.patient_id = u.id
+                    WHERE pr.status = 'Pending' AND pr.claimed_by = ?
+                    ORDER BY pr.queue_rank DESC, pr.id""", (doctor_id,)).fetchall()
+    flush_records()
+    with QUERY_SECONDS.time(query="claim_review_cases"):
+        return format_records(run_with_retry(claim))
+
+def release_claims(doctor_id):
+    # Returns the doctor's unreviewed cases to the queue, e.g. on logout
+    def release():
+        with connection() as conn:
+            with conn:
+                conn.execute("""UPDATE patient_records SET claimed_by = NULL, claimed_at = NULL
+                                WHERE status = 'Pending' AND claimed_by = ?""", (doctor_id,))
+    with QUERY_SECONDS.time(query="release_claims"):
+        run_with_retry(release)
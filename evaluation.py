@@ -0,0 +1,157 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.metrics import classification_report, confusion_matrix
+
+from backends import BACKENDS, exported_model_path, load_backend, load_labels
+from bulk_scan import chunked
+from export_model import list_dataset
+from prediction_cache import file_version
+from score import preprocess_chunk
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def load_split(data_dir, class_labels, limit=None, workers=None, chunk_size=64):
+    # Decodes the whole split once, in parallel worker processes, into one float32 array
+    # that every backend and batch size is then timed against
+    samples = list_dataset(data_dir, class_labels, limit=limit)
+    if not samples:
+        raise ValueError(f"No images found in {data_dir}")
+    labels = dict(samples)
+    paths, batches, y_true = [], [], []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        for ok_paths, batch, _, failures in pool.map(preprocess_chunk, chunked([path for path, _ in samples], chunk_size)):
+            for path, error in failures:
+                print(f"Skipping {path}: {error}", file=sys.stderr)
+            paths.extend(ok_paths)
+            batches.append(batch)
+            y_true.extend(labels[path] for path in ok_paths)
+    return paths, np.concatenate(batches), np.array(y_true)
+
+
+def timed_predict(model, images, batch_size, warmup_batches=2):
+    # One pass over images in fixed-size batches, timing every predict_on_batch call
+    for start in range(0, min(len(images), warmup_batches * batch_size), batch_size):
+        model.predict_on_batch(images[start:start + batch_size])
+    predictions, latencies = [], []
+    total_start = time.perf_counter()
+    for start in range(0, len(images), batch_size):
+        batch_start = time.perf_counter()
+        predictions.append(np.asarray(model.predict_on_batch(images[start:start + batch_size])))
+        latencies.append(time.perf_counter() - batch_start)
+    elapsed = time.perf_counter() - total_start
+    latencies_ms = np.array(latencies) * 1000
+    timing = {
+        "batch_size": batch_size,
+        "batches": len(latencies),
+        "seconds": round(elapsed, 4),
+        "images_per_sec": round(len(images) / elapsed, 2),
+        "batch_latency_ms": {f"p{p}": round(float(np.percentile(latencies_ms, p)), 3) for p in PERCENTILES},
+        "per_image_ms_p50": round(float(np.percentile(latencies_ms, 50)) / batch_size, 4),
+    }
+    timing["batch_latency_ms"]["max"] = round(float(latencies_ms.max()), 3)
+    return np.concatenate(predictions), timing
+
+
+def classification_metrics(y_true, predictions, class_labels):
+    names = [class_labels[i] for i in sorted(class_labels)]
+    y_pred = predictions.argmax(axis=1)
+    return {
+        "accuracy": float(np.mean(y_pred == y_true)),
+        "classification_report": classification_report(y_true, y_pred, labels=sorted(class_labels), target_names=names,
+                                                       output_dict=True, zero_division=0),
+        "confusion_matrix": {"labels": names,
+                             "matrix": confusion_matrix(y_true, y_pred, labels=sorted(class_labels)).tolist()},
+    }
+
+
+def evaluate(model_path, backends, batch_sizes, images, y_true, class_labels, num_threads=None):
+    results = []
+    for backend in backends:
+        model = load_backend(model_path, backend, num_threads=num_threads)
+        result = {"backend": backend, "model_version": file_version(exported_model_path(model_path, backend)), "timings": []}
+        for batch_size in batch_sizes:
+            predictions, timing = timed_predict(model, images, batch_size)
+            result["timings"].append(timing)
+            # Outputs do not depend on batch size, so metrics come from the first pass
+            if "accuracy" not in result:
+                result.update(classification_metrics(y_true, predictions, class_labels))
+        results.append(result)
+    return results
+
+
+def compare(report, baseline, max_accuracy_drop=0.005, max_slowdown=0.15):
+    # Returns human-readable regressions of report against a previous evaluation JSON
+    regressions = []
+    previous = {r["backend"]: r for r in baseline.get("results", [])}
+    for result in report["results"]:
+        before = previous.get(result["backend"])
+        if before is None:
+            continue
+        drop = before["accuracy"] - result["accuracy"]
+        if drop > max_accuracy_drop:
+            regressions.append(f"{result['backend']}: accuracy {before['accuracy']:.4f} -> {result['accuracy']:.4f}")
+        before_timings = {t["batch_size"]: t for t in before["timings"]}
+        for timing in result["timings"]:
+            old = before_timings.get(timing["batch_size"])
+            if old and timing["images_per_sec"] < old["images_per_sec"] * (1 - max_slowdown):
+                regressions.append(f"{result['backend']} batch {timing['batch_size']}: "
+                                   f"{old['images_per_sec']:.1f} -> {timing['images_per_sec']:.1f} images/sec")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate accuracy and inference speed on a dataset split")
+    parser.add_argument("--data-dir", default=os.path.join("Processed Dataset", "test"))
+    parser.add_argument("--model", default="best_model.h5")
+    parser.add_argument("--labels", default="class_labels.json")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=["keras"])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 16, 64])
+    parser.add_argument("--limit", type=int, help="Evaluate a fixed random subset of this many images")
+    parser.add_argument("--workers", type=int, help="Decode processes (default: all cores)")
+    parser.add_argument("--threads", type=int, help="Intra-op threads for the TFLite backends")
+    parser.add_argument("--output", default="evaluation.json")
+    parser.add_argument("--baseline", help="Previous evaluation JSON; exit non-zero on regressions")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.005)
+    parser.add_argument("--max-slowdown", type=float, default=0.15, help="Allowed fractional drop in images/sec")
+    args = parser.parse_args()
+
+    class_labels = load_labels(args.labels)
+    start = time.perf_counter()
+    paths, images, y_true = load_split(args.data_dir, class_labels, limit=args.limit, workers=args.workers)
+    decode_seconds = time.perf_counter() - start
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "data_dir": args.data_dir,
+        "samples": len(paths),
+        "decode_seconds": round(decode_seconds, 3),
+        "cpu_count": os.cpu_count(),
+        "results": evaluate(args.model, args.backends, args.batch_sizes, images, y_true, class_labels, args.threads),
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for result in report["results"]:
+        rates = ", ".join(f"batch {t['batch_size']}: {t['images_per_sec']:.1f} img/s (p95 {t['batch_latency_ms']['p95']:.1f} ms)"
+                          for t in result["timings"])
+        print(f"{result['backend']:<12} accuracy {result['accuracy']:.4f}  {rates}")
+    print(f"Wrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare(report, json.load(f), args.max_accuracy_drop, args.max_slowdown)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
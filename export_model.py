@@ -0,0 +1,112 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+from backends import BACKENDS, exported_model_path, load_backend, load_labels
+from preprocessing import Preprocessor
+
+IMG_SIZE = 150
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+preprocessor = Preprocessor(size=IMG_SIZE, max_batch_size=32)
+
+
+def load_image(path):
+    # Same preprocessing as process_xray in app.py
+    return preprocessor.preprocess(path)
+
+
+def list_dataset(data_dir, class_labels, limit=None):
+    # Same layout flow_from_directory reads in PDD.ipynb: one sub-folder per class
+    samples = []
+    for index, label in sorted(class_labels.items()):
+        class_dir = os.path.join(data_dir, label)
+        if not os.path.isdir(class_dir):
+            continue
+        for name in sorted(os.listdir(class_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                samples.append((os.path.join(class_dir, name), index))
+    if limit:
+        rng = np.random.default_rng(0)
+        order = rng.permutation(len(samples))[:limit]
+        samples = [samples[i] for i in sorted(order)]
+    return samples
+
+
+def export_tflite(model_path, backend, val_dir, class_labels, calibration_samples=300):
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(model_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if backend == "tflite-int8":
+        samples = list_dataset(val_dir, class_labels, limit=calibration_samples)
+        if not samples:
+            raise ValueError(f"No calibration images found in {val_dir}")
+
+        def representative_dataset():
+            for path, _ in samples:
+                yield [load_image(path)[np.newaxis]]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    output_path = exported_model_path(model_path, backend)
+    with open(output_path, "wb") as f:
+        f.write(converter.convert())
+    return output_path
+
+
+def predict_dataset(model, samples, batch_size=32):
+    predictions = []
+    buffer = np.empty((batch_size, IMG_SIZE, IMG_SIZE, 1), dtype=np.float32)
+    for start in range(0, len(samples), batch_size):
+        batch = preprocessor.preprocess_batch([path for path, _ in samples[start:start + batch_size]], out=buffer)
+        predictions.append(np.array(model.predict_on_batch(batch)))
+    return np.concatenate(predictions)
+
+
+def parity_check(model_path, backend, val_dir, class_labels, limit=None):
+    samples = list_dataset(val_dir, class_labels, limit=limit)
+    if not samples:
+        raise ValueError(f"No validation images found in {val_dir}")
+    y_true = np.array([index for _, index in samples])
+    reference = predict_dataset(load_backend(model_path, "keras"), samples)
+    candidate = predict_dataset(load_backend(model_path, backend), samples)
+    keras_accuracy = float(np.mean(reference.argmax(axis=1) == y_true))
+    backend_accuracy = float(np.mean(candidate.argmax(axis=1) == y_true))
+    return {
+        "backend": backend,
+        "samples": len(samples),
+        "keras_accuracy": keras_accuracy,
+        "backend_accuracy": backend_accuracy,
+        "accuracy_drift": backend_accuracy - keras_accuracy,
+        "label_agreement": float(np.mean(reference.argmax(axis=1) == candidate.argmax(axis=1))),
+        "max_probability_diff": float(np.max(np.abs(reference - candidate))),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export best_model.h5 to a lighter inference backend")
+    parser.add_argument("--model", default="best_model.h5")
+    parser.add_argument("--labels", default="class_labels.json")
+    parser.add_argument("--backend", choices=[b for b in BACKENDS if b != "keras"], default="tflite-int8")
+    parser.add_argument("--val-dir", default=os.path.join("Processed Dataset", "val"))
+    parser.add_argument("--calibration-samples", type=int, default=300)
+    parser.add_argument("--parity-samples", type=int, default=None)
+    parser.add_argument("--skip-parity", action="store_true")
+    args = parser.parse_args()
+
+    class_labels = load_labels(args.labels)
+    output_path = export_tflite(args.model, args.backend, args.val_dir, class_labels, args.calibration_samples)
+    print(f"Exported {args.model} -> {output_path} ({os.path.getsize(output_path) / 1e6:.2f} MB)")
+
+    if not args.skip_parity:
+        report = parity_check(args.model, args.backend, args.val_dir, class_labels, limit=args.parity_samples)
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import argparse
+import logging
+import os
+import sys
+import threading
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import db
+from image_store import ImageStore, atomic_write
+from prediction_cache import file_version
+
+logger = logging.getLogger("pneumoscan.gradcam")
+
+
+def last_conv_layer(model):
+    import tensorflow as tf
+    for layer in reversed(model.layers):
+        if isinstance(layer, tf.keras.layers.Conv2D):
+            return layer
+    raise ValueError("model has no Conv2D layer")
+
+
+# Batched Grad-CAM over the last Conv2D layer: the class score's gradients w.r.t. that layer's
+# feature maps, averaged per channel, weight the maps into one coarse saliency map per image.
+class GradCam:
+    def __init__(self, model, model_version):
+        import tensorflow as tf
+        self.model_version = model_version
+        self.layer = last_conv_layer(model)
+        self._model = tf.keras.Model(model.inputs, [self.layer.output, model.output])
+        self._lock = threading.Lock()
+
+    def compute(self, images, class_indices=None):
+        # images: (n, 150, 150, 1) float32; returns (n, h, w) maps scaled to [0, 1], for the
+        # predicted class unless class_indices is given
+        import tensorflow as tf
+        images = tf.convert_to_tensor(images, dtype=tf.float32)
+        with self._lock:
+            with tf.GradientTape() as tape:
+                feature_maps, predictions = self._model(images, training=False)
+                if class_indices is None:
+                    class_indices = tf.argmax(predictions, axis=1)
+                # Images are independent in inference mode, so one gradient of the summed
+                # scores gives every image its own gradients
+                scores = tf.gather(predictions, class_indices, batch_dims=1)
+            gradients = tape.gradient(scores, feature_maps)
+        weights = tf.reduce_mean(gradients, axis=(1, 2))
+        cams = tf.nn.relu(tf.einsum("nhwc,nc->nhw", feature_maps, weights)).numpy()
+        peaks = cams.reshape(len(cams), -1).max(axis=1)
+        return cams / np.maximum(peaks, 1e-8)[:, None, None]
+
+
+def overlay(image, cam, alpha=0.4):
+    # image: (150, 150, 1) float32 in [0, 1]; returns an RGB uint8 heatmap blended over the scan
+    size = image.shape[:2]
+    gray = np.rint(image[..., 0] * 255).astype(np.uint8)
+    heat = cv2.resize(np.rint(cam * 255).astype(np.uint8), (size[1], size[0]), interpolation=cv2.INTER_LINEAR)
+    heat = cv2.cvtColor(cv2.applyColorMap(heat, cv2.COLORMAP_JET), cv2.COLOR_BGR2RGB)
+    return cv2.addWeighted(heat, alpha, np.repeat(gray[..., None], 3, axis=2), 1 - alpha, 0)
+
+
+# Rendered heatmap overlays on disk: <root>/<model_version>/<record_id[:2]>/<record_id>.png.
+# A new model version writes to a fresh directory, so stale maps are never served.
+class HeatmapCache:
+    def __init__(self, root="heatmap_cache"):
+        self.root = root
+
+    def path(self, record_id, model_version):
+        return os.path.join(self.root, model_version, record_id[:2], record_id + ".png")
+
+    def get(self, record_id, model_version):
+        path = self.path(record_id, model_version)
+        return path if os.path.exists(path) else None
+
+    def put(self, record_id, model_version, rgb):
+        path = self.path(record_id, model_version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, lambda f: Image.fromarray(rgb).save(f, format="PNG"))
+        return path
+
+
+def ensure_heatmaps(gradcam, cache, image_store, records, batch_size=16):
+    # records are (record_id, image_hash) pairs. Computes the missing overlays in batches and
+    # returns {record_id: path} for every record that has one.
+    paths, missing = {}, []
+    for record_id, image_hash in records:
+        path = cache.get(record_id, gradcam.model_version)
+        if path:
+            paths[record_id] = path
+        elif image_hash and os.path.exists(image_store.array_path(image_hash)):
+            missing.append((record_id, image_hash))
+    for start in range(0, len(missing), batch_size):
+        part = missing[start:start + batch_size]
+        images = image_store.load_batch([image_hash for _, image_hash in part])
+        for (record_id, _), image, cam in zip(part, images, gradcam.compute(images)):
+            paths[record_id] = cache.put(record_id, gradcam.model_version, overlay(image, cam))
+    return paths
+
+
+def load_gradcam(model_path="best_model.h5", model=None, model_version=None):
+    # Grad-CAM needs the Keras model even when predictions are served by a TFLite backend. A model
+    # that is passed in comes with the version of the file it was loaded from
+    import tensorflow as tf
+    if model is None:
+        model_version = file_version(model_path)
+        model = tf.keras.models.load_model(model_path)
+    return GradCam(model, model_version or file_version(model_path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute Grad-CAM heatmaps for the review queue")
+    parser.add_argument("--db", default=db.DB_PATH)
+    parser.add_argument("--image-store", default="image_store")
+    parser.add_argument("--cache-dir", default="heatmap_cache")
+    parser.add_argument("--model", default="best_model.h5")
+    parser.add_argument("--status", choices=["Pending", "Reviewed"], default="Pending")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    db.use_database(args.db)
+    records = [(record[0], record[11]) for record in db.get_patient_records(status=args.status)]
+    gradcam = load_gradcam(args.model)
+    paths = ensure_heatmaps(gradcam, HeatmapCache(args.cache_dir), ImageStore(args.image_store), records,
+                            batch_size=args.batch_size)
+    print(f"Model {gradcam.model_version}: heatmaps for {len(paths)} of {len(records)} {args.status.lower()} records "
+          f"(the rest have no stored image)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from preprocessing import IMG_SIZE, Preprocessor
+
+THUMBNAIL_SIZE = 128
+
+
+def atomic_write(path, write):
+    # Write to a temp file then rename, so concurrent writers of the same file never expose partial files
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def pixel_digest(pixels):
+    digest = hashlib.sha256()
+    digest.update(str(pixels.shape).encode())
+    digest.update(pixels.tobytes())
+    return digest.hexdigest()
+
+
+# Content-addressed store of uploaded scans, keyed by a hash of the decoded grayscale pixels:
+#   <root>/<digest[:2]>/<digest>.npy  preprocessed (150, 150, 1) float32, readable with mmap
+#   <root>/<digest[:2]>/<digest>.jpg  small thumbnail for the dashboards
+# Re-uploads of the same scan map to the same files and are only written once.
+class ImageStore:
+    def __init__(self, root="image_store", thumbnail_size=THUMBNAIL_SIZE):
+        self.root = root
+        self.thumbnail_size = thumbnail_size
+        self._preprocessor = Preprocessor(size=IMG_SIZE, max_batch_size=1, pool_size=0)
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, digest, extension):
+        return os.path.join(self.root, digest[:2], digest + extension)
+
+    def array_path(self, digest):
+        return self._path(digest, ".npy")
+
+    def thumbnail_path(self, digest):
+        return self._path(digest, ".jpg")
+
+    def exists(self, digest):
+        return os.path.exists(self.array_path(digest)) and os.path.exists(self.thumbnail_path(digest))
+
+    def put(self, pixels, preprocessed=None):
+        # pixels is the decoded uint8 grayscale image; preprocessed may be passed to avoid recomputing it
+        digest = pixel_digest(pixels)
+        if self.exists(digest):
+            return digest
+        os.makedirs(os.path.dirname(self.array_path(digest)), exist_ok=True)
+        if preprocessed is None:
+            preprocessed = self._preprocessor.preprocess_pixels(pixels)
+        atomic_write(self.array_path(digest), lambda f: np.save(f, np.asarray(preprocessed, dtype=np.float32)))
+        thumbnail = Image.fromarray(pixels)
+        thumbnail.thumbnail((self.thumbnail_size, self.thumbnail_size))
+        atomic_write(self.thumbnail_path(digest), lambda f: thumbnail.save(f, format="JPEG", quality=85))
+        return digest
+
+    def load_array(self, digest, mmap=True):
+        # Memory-mapped by default so re-scoring jobs page in arrays without decoding or copying
+        return np.load(self.array_path(digest), mmap_mode="r" if mmap else None)
+
+    def load_batch(self, digests, out=None):
+        if out is None:
+            out = np.empty((len(digests), IMG_SIZE, IMG_SIZE, 1), dtype=np.float32)
+        for i, digest in enumerate(digests):
+            out[i] = self.load_array(digest)
+        return out[:len(digests)]
@@ -0,0 +1,119 @@
+import threading
+import queue
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+import metrics
+
+QUEUE_WAIT = metrics.histogram("pneumoscan_inference_queue_wait_seconds",
+                               "Time a request waits in the engine queue before its batch runs")
+BATCH_SIZE = metrics.histogram("pneumoscan_inference_batch_size", "Images coalesced per model call",
+                               buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+PREDICT_SECONDS = metrics.histogram("pneumoscan_model_predict_seconds", "Time per batched model call")
+QUEUE_DEPTH = metrics.gauge("pneumoscan_inference_queue_depth", "Requests waiting in the inference engine queue")
+
+
+# Shared inference engine: requests from every session are queued and
+# coalesced into one model.predict call per batch.
+class InferenceEngine:
+    def __init__(self, model, max_batch_size=16, max_wait_ms=10):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._buffer = None
+        self._worker = threading.Thread(target=self._run, name="inference-engine", daemon=True)
+        self._worker.start()
+        QUEUE_DEPTH.set_function(self.queue_depth)
+
+    def submit(self, image_tensor):
+        # image_tensor is a single preprocessed (150, 150, 1) array
+        future = Future()
+        self._queue.put((image_tensor[np.newaxis], future, time.perf_counter(), True))
+        return future
+
+    def submit_batch(self, image_tensors):
+        # Rows of image_tensors are never split across model calls; the future resolves to
+        # their (n, classes) predictions
+        future = Future()
+        self._queue.put((np.asarray(image_tensors, dtype=np.float32), future, time.perf_counter(), False))
+        return future
+
+    def predict_batch(self, image_tensors, timeout=None):
+        return self.submit_batch(image_tensors).result(timeout=timeout)
+
+    def predict(self, image_tensor, timeout=None):
+        return self.submit(image_tensor).result(timeout=timeout)
+
+    def predict_many(self, image_tensors, timeout=None):
+        futures = [self.submit(t) for t in image_tensors]
+        return [f.result(timeout=timeout) for f in futures]
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def shutdown(self):
+        # Requests already queued are still served before the worker exits
+        self._queue.put(None)
+        self._worker.join()
+
+    def _collect_batch(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        rows = len(item[0])
+        deadline = time.monotonic() + self.max_wait
+        while rows < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Re-queue the sentinel so the worker exits after this batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+            rows += len(item[0])
+        return batch
+
+    def _stack(self, inputs):
+        # Reuse one float32 batch buffer instead of allocating a new stacked array per batch
+        shape = inputs[0].shape[1:]
+        rows = sum(len(t) for t in inputs)
+        if self._buffer is None or self._buffer.shape[1:] != shape or len(self._buffer) < rows:
+            self._buffer = np.empty((max(self.max_batch_size, rows),) + shape, dtype=np.float32)
+        return np.concatenate(inputs, out=self._buffer[:rows])
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            inputs = [t for t, _, _, _ in batch]
+            started = time.perf_counter()
+            for _, _, queued, _ in batch:
+                QUEUE_WAIT.observe(started - queued)
+            BATCH_SIZE.observe(sum(len(t) for t in inputs))
+            try:
+                with PREDICT_SECONDS.time():
+                    predictions = self.model.predict_on_batch(self._stack(inputs))
+                    predictions = np.asarray(predictions)
+            except Exception as e:
+                metrics.ERRORS.inc(stage="predict")
+                for _, future, _, _ in batch:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for tensors, future, _, single in batch:
+                rows = len(tensors)
+                future.set_result(predictions[offset] if single else predictions[offset:offset + rows])
+                offset += rows
@@ -0,0 +1,98 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+import metrics
+
+CACHE_LOOKUPS = metrics.counter("pneumoscan_prediction_cache_lookups_total", "Prediction cache lookups", ["result"])
+
+
+def file_version(path):
+    # Content hash of the model file, used to tag cached predictions
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def image_key(pixels, model_version):
+    # Key on the decoded pixels so re-encoded copies of the same scan still hit
+    digest = hashlib.sha256()
+    digest.update(model_version.encode())
+    digest.update(str(pixels.shape).encode())
+    digest.update(str(pixels.dtype).encode())
+    digest.update(pixels.tobytes())
+    return digest.hexdigest()
+
+
+# Persistent LRU cache of (label, confidence) per image and model version
+class PredictionCache:
+    def __init__(self, path="prediction_cache.db", version_fn=None, max_entries=10000):
+        # version_fn reports the version of the model that is serving predictions: the hash taken
+        # when the engine loaded its model, or the version reported by api.py. Keying on the file
+        # on disk instead would file the old in-memory model's results under a replaced file's version
+        self.path = path
+        self.version_fn = version_fn
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Every hit commits a last_used update; in WAL mode with synchronous=NORMAL those commits
+        # append to the log without an fsync each (durable across app crashes, as in db.connect)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS prediction_cache (
+            key TEXT PRIMARY KEY, model_version TEXT NOT NULL, label TEXT NOT NULL,
+            confidence REAL NOT NULL, last_used REAL NOT NULL)''')
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_prediction_cache_last_used ON prediction_cache (last_used)")
+        self._conn.commit()
+        self.model_version = None
+
+    def refresh_model_version(self):
+        # Drops entries from other model versions whenever the serving model's version changes
+        version = self.version_fn()
+        if version and version != self.model_version:
+            self.model_version = version
+            self.invalidate(keep_version=version)
+        return self.model_version
+
+    def key(self, pixels):
+        return image_key(pixels, self.refresh_model_version() or "")
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT label, confidence FROM prediction_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                CACHE_LOOKUPS.inc(result="miss")
+                return None
+            CACHE_LOOKUPS.inc(result="hit")
+            self._conn.execute("UPDATE prediction_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return row[0], row[1]
+
+    def put(self, key, label, confidence):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO prediction_cache VALUES (?, ?, ?, ?, ?)",
+                (key, self.model_version or "", label, float(confidence), time.time()))
+            self._evict()
+            self._conn.commit()
+
+    def invalidate(self, keep_version=None):
+        with self._lock:
+            if keep_version is None:
+                self._conn.execute("DELETE FROM prediction_cache")
+            else:
+                self._conn.execute("DELETE FROM prediction_cache WHERE model_version != ?", (keep_version,))
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM prediction_cache").fetchone()[0]
+
+    def _evict(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM prediction_cache").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute("""DELETE FROM prediction_cache WHERE key IN (
+                SELECT key FROM prediction_cache ORDER BY last_used ASC LIMIT ?)""",
+                (count - self.max_entries,))
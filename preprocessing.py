@@ -0,0 +1,95 @@
+import io
+import os
+import queue
+import threading
+
+import cv2
+import numpy as np
+from PIL import Image
+
+IMG_SIZE = 150
+# Draft decoding scales large JPEGs down inside libjpeg, which is much faster but yields slightly
+# different pixels than the full-resolution decode the model was trained with. Opt in with
+# PNEUMOSCAN_DRAFT_DECODE=1 once `benchmarks/bench_preprocess.py --parity` shows predictions agree.
+DRAFT_DECODE = os.environ.get("PNEUMOSCAN_DRAFT_DECODE") == "1"
+
+
+def open_image(source):
+    if isinstance(source, Image.Image):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(source))
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return Image.open(source)
+
+
+def decode_grayscale(source, size=IMG_SIZE, draft=None):
+    image = open_image(source)
+    if DRAFT_DECODE if draft is None else draft:
+        # For JPEGs that are not decoded yet this makes libjpeg decode straight to
+        # grayscale at the smallest DCT scale still >= size; other formats ignore it
+        image.draft("L", (size, size))
+    if image.mode != "L":
+        image = image.convert("L")
+    return np.asarray(image)
+
+
+# Decodes and normalizes images into reusable float32 batch buffers of shape (n, size, size, 1)
+class Preprocessor:
+    def __init__(self, size=IMG_SIZE, max_batch_size=32, pool_size=4):
+        self.size = size
+        self.max_batch_size = max_batch_size
+        self._scale = np.float32(1.0 / 255.0)
+        self._local = threading.local()
+        self._buffers = queue.LifoQueue()
+        for _ in range(pool_size):
+            self._buffers.put(self._new_buffer())
+
+    def _new_buffer(self):
+        return np.empty((self.max_batch_size, self.size, self.size, 1), dtype=np.float32)
+
+    def _scratch(self):
+        # Per-thread uint8 resize target so concurrent sessions never share one
+        scratch = getattr(self._local, "scratch", None)
+        if scratch is None:
+            scratch = self._local.scratch = np.empty((self.size, self.size), dtype=np.uint8)
+        return scratch
+
+    def normalize_into(self, pixels, out):
+        # out is a (size, size) float32 view; the only intermediate is the reused scratch
+        if pixels.shape != (self.size, self.size):
+            pixels = cv2.resize(pixels, (self.size, self.size), dst=self._scratch(), interpolation=cv2.INTER_LINEAR)
+        np.multiply(pixels, self._scale, out=out, dtype=np.float32)
+        return out
+
+    def preprocess_pixels(self, pixels):
+        out = np.empty((self.size, self.size, 1), dtype=np.float32)
+        self.normalize_into(pixels, out[..., 0])
+        return out
+
+    def preprocess(self, source):
+        # Single image as a (size, size, 1) float32 array, e.g. for InferenceEngine.submit
+        return self.preprocess_pixels(decode_grayscale(source, self.size))
+
+    def preprocess_batch(self, sources, out=None):
+        # Fills out[:len(sources)] in place. With out=None a pooled buffer is borrowed;
+        # hand it back with release() once the batch has been predicted.
+        if out is None:
+            out = self.acquire()
+        if len(sources) > out.shape[0]:
+            raise ValueError(f"Batch of {len(sources)} images exceeds buffer size {out.shape[0]}")
+        for i, source in enumerate(sources):
+            self.normalize_into(decode_grayscale(source, self.size), out[i, :, :, 0])
+        return out[:len(sources)]
+
+    def acquire(self):
+        try:
+            return self._buffers.get_nowait()
+        except queue.Empty:
+            return self._new_buffer()
+
+    def release(self, batch):
+        buffer = batch if batch.base is None else batch.base
+        if buffer.shape == (self.max_batch_size, self.size, self.size, 1):
+            self._buffers.put(buffer)
@@ -0,0 +1,122 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+import db
+from backends import BACKENDS, exported_model_path, load_backend, load_labels
+from image_store import ImageStore
+from prediction_cache import file_version
+from preprocessing import IMG_SIZE
+
+logger = logging.getLogger("pneumoscan.rescore")
+
+
+# Re-scores records whose model_version differs from the current model, in id order.
+# Progress is checkpointed to state_path after every chunk, so a restarted job resumes
+# from the last finished id; a new model version starts the walk over.
+class Rescorer:
+    def __init__(self, model, class_labels, model_version, image_store, state_path="rescore_state.json",
+                 chunk_size=256, batch_size=32, max_images_per_sec=None, status=None):
+        self.model = model
+        self.class_labels = class_labels
+        self.model_version = model_version
+        self.image_store = image_store
+        self.state_path = state_path
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.max_images_per_sec = max_images_per_sec
+        self.status = status
+        self._buffer = np.empty((batch_size, IMG_SIZE, IMG_SIZE, 1), dtype=np.float32)
+
+    def load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+            if state.get("model_version") == self.model_version:
+                return state
+        return {"model_version": self.model_version, "last_id": "", "rescored": 0, "missing": 0}
+
+    def save_state(self, state):
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def score_chunk(self, rows):
+        available = [(record_id, image_hash) for record_id, image_hash in rows if os.path.exists(self.image_store.array_path(image_hash))]
+        updates = []
+        for start in range(0, len(available), self.batch_size):
+            part = available[start:start + self.batch_size]
+            batch = self.image_store.load_batch([image_hash for _, image_hash in part], out=self._buffer)
+            predictions = np.asarray(self.model.predict_on_batch(batch))
+            for (record_id, _), prediction in zip(part, predictions):
+                updates.append((self.class_labels[int(np.argmax(prediction))], float(np.max(prediction)) * 100,
+                                self.model_version, record_id))
+        # Guarded by status too, so a case reviewed while this chunk was scored keeps its assessment
+        db.update_record_predictions(updates, status=self.status)
+        return len(updates), len(rows) - len(available)
+
+    def run(self, max_chunks=None):
+        state = self.load_state()
+        chunks = 0
+        while max_chunks is None or chunks < max_chunks:
+            rows = db.get_stale_records(self.model_version, after_id=state["last_id"], limit=self.chunk_size, status=self.status)
+            if not rows:
+                break
+            start = time.perf_counter()
+            rescored, missing = self.score_chunk(rows)
+            state["last_id"] = rows[-1][0]
+            state["rescored"] += rescored
+            state["missing"] += missing
+            self.save_state(state)
+            chunks += 1
+            elapsed = time.perf_counter() - start
+            logger.info("Rescored %d records (%d total, %d without stored image), up to id %s",
+                        rescored, state["rescored"], state["missing"], state["last_id"])
+            # Rate limit so the job leaves CPU for live inference
+            if self.max_images_per_sec and rescored:
+                time.sleep(max(0.0, rescored / self.max_images_per_sec - elapsed))
+        return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score stored scans that were predicted by an older model")
+    parser.add_argument("--db", default=db.DB_PATH)
+    parser.add_argument("--image-store", default="image_store")
+    parser.add_argument("--model", default="best_model.h5")
+    parser.add_argument("--labels", default="class_labels.json")
+    parser.add_argument("--backend", choices=BACKENDS, default=os.environ.get("PNEUMOSCAN_BACKEND", "keras"))
+    parser.add_argument("--state", default="rescore_state.json")
+    parser.add_argument("--chunk-size", type=int, default=256, help="Records updated per transaction")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-images-per-sec", type=float, default=50.0, help="0 disables rate limiting")
+    # Reviewed records keep the AI assessment the doctor signed off on unless explicitly included
+    parser.add_argument("--status", choices=["Pending", "Reviewed", "all"], default="Pending",
+                        help="Records to re-score (default: Pending)")
+    parser.add_argument("--threads", type=int, default=1, help="Intra-op threads for the TFLite backends")
+    parser.add_argument("--nice", type=int, default=10, help="Lower this process's CPU priority")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    if args.nice and hasattr(os, "nice"):
+        os.nice(args.nice)
+    db.use_database(args.db)
+
+    model_version = file_version(exported_model_path(args.model, args.backend))
+    model = load_backend(args.model, args.backend, num_threads=args.threads)
+    rescorer = Rescorer(model, load_labels(args.labels), model_version, ImageStore(args.image_store),
+                        state_path=args.state, chunk_size=args.chunk_size, batch_size=args.batch_size,
+                        max_images_per_sec=args.max_images_per_sec or None,
+                        status=None if args.status == "all" else args.status)
+    state = rescorer.run()
+    print(f"Model {model_version}: {state['rescored']} records re-scored, "
+          f"{state['missing']} skipped without a stored image", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
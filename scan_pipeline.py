@@ -0,0 +1,124 @@
+import time
+
+import numpy as np
+
+import metrics
+from metrics import ERRORS, STAGE_SECONDS
+from preprocessing import decode_grayscale
+
+REFINED_SCANS = metrics.counter("pneumoscan_refined_scans_total", "Low-confidence scans re-scored with TTA/ensemble")
+
+
+def build_refiner(predict_views, threshold, tta=True, shift=8, ensemble_models=(), backend="keras"):
+    # None when refinement is disabled (threshold <= 0)
+    if threshold <= 0:
+        return None
+    from tta import Ensemble, Refiner
+    ensemble = Ensemble(ensemble_models, backend) if ensemble_models else None
+    return Refiner(predict_views, threshold, flip=tta, shift=shift if tta else 0, ensemble=ensemble)
+
+
+# The scan path behind process_xray and process_xray_batch in app.py, without any UI: decode,
+# prediction cache, normalize, image store, predict and low-confidence refinement, with a stage
+# timer around each step. predict_scans(pixels, batch) returns one probability vector per scan
+# (the shared engine, worker pool or inference API); refiner is a tta.Refiner or None.
+class ScanPipeline:
+    def __init__(self, cache, image_store, preprocessor, class_labels, predict_scans, refiner=None):
+        self.cache = cache
+        self.image_store = image_store
+        self.preprocessor = preprocessor
+        self.class_labels = class_labels
+        self.predict_scans = predict_scans
+        self.refiner = refiner
+
+    @property
+    def max_batch_size(self):
+        return self.preprocessor.max_batch_size
+
+    def refine(self, predictions, tensors):
+        # Only borderline scans pay for the extra views; all of them share one batched call
+        if self.refiner is None:
+            return predictions
+        low = [i for i, prediction in enumerate(predictions) if self.refiner.should_refine(float(np.max(prediction)) * 100)]
+        if not low:
+            return predictions
+        with STAGE_SECONDS.time(stage="refine"):
+            refined = self.refiner.refine([tensors[i] for i in low])
+        REFINED_SCANS.inc(len(low))
+        predictions = list(predictions)
+        for i, prediction in zip(low, refined):
+            predictions[i] = prediction
+        return predictions
+
+    def _result(self, cache_key, prediction):
+        label = self.class_labels[int(np.argmax(prediction))]
+        confidence = float(np.max(prediction)) * 100
+        self.cache.put(cache_key, label, confidence)
+        return label, confidence
+
+    def scan(self, image):
+        # Returns (prediction, confidence, image_hash); errors propagate to the caller
+        start = time.perf_counter()
+        with STAGE_SECONDS.time(stage="decode"):
+            pixels = decode_grayscale(image)
+        with STAGE_SECONDS.time(stage="cache_lookup"):
+            cache_key = self.cache.key(pixels)
+            cached = self.cache.get(cache_key)
+        if cached is not None:
+            with STAGE_SECONDS.time(stage="store"):
+                image_hash = self.image_store.put(pixels)
+            STAGE_SECONDS.observe(time.perf_counter() - start, stage="total")
+            return cached + (image_hash,)
+
+        with STAGE_SECONDS.time(stage="normalize"):
+            tensor = self.preprocessor.preprocess_pixels(pixels)
+        with STAGE_SECONDS.time(stage="store"):
+            image_hash = self.image_store.put(pixels, tensor)
+        # Includes time queued behind other sessions' requests in the shared engine, or the API round trip
+        with STAGE_SECONDS.time(stage="predict"):
+            prediction = self.predict_scans([pixels], [tensor])[0]
+        prediction = self.refine([prediction], [tensor])[0]
+        label, confidence = self._result(cache_key, prediction)
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage="total")
+        return label, confidence, image_hash
+
+    def scan_batch(self, images, on_decode_error=None):
+        # images is a list of (name, encoded bytes), at most max_batch_size long. Returns
+        # (prediction, confidence, image_hash) per image, all None for files that could not be
+        # decoded; on_decode_error(name, error) is called for each of those.
+        results = [(None, None, None)] * len(images)
+        pending = []
+        for i, (name, data) in enumerate(images):
+            try:
+                with STAGE_SECONDS.time(stage="decode"):
+                    pixels = decode_grayscale(data)
+            except Exception as e:
+                ERRORS.inc(stage="decode")
+                if on_decode_error is not None:
+                    on_decode_error(name, e)
+                continue
+            with STAGE_SECONDS.time(stage="cache_lookup"):
+                cache_key = self.cache.key(pixels)
+                cached = self.cache.get(cache_key)
+            if cached is not None:
+                with STAGE_SECONDS.time(stage="store"):
+                    results[i] = cached + (self.image_store.put(pixels),)
+            else:
+                pending.append((i, cache_key, pixels))
+
+        if pending:
+            batch = self.preprocessor.acquire()
+            try:
+                with STAGE_SECONDS.time(stage="normalize"):
+                    for j, (_, _, pixels) in enumerate(pending):
+                        self.preprocessor.normalize_into(pixels, batch[j, :, :, 0])
+                with STAGE_SECONDS.time(stage="predict_batch"):
+                    predictions = self.predict_scans([pixels for _, _, pixels in pending], batch[:len(pending)])
+                predictions = self.refine(predictions, batch)
+                with STAGE_SECONDS.time(stage="store"):
+                    image_hashes = [self.image_store.put(pixels, batch[j]) for j, (_, _, pixels) in enumerate(pending)]
+            finally:
+                self.preprocessor.release(batch)
+            for (i, cache_key, _), prediction, image_hash in zip(pending, predictions, image_hashes):
+                results[i] = self._result(cache_key, prediction) + (image_hash,)
+        return results
@@ -0,0 +1,194 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import db
+from backends import BACKENDS, exported_model_path, load_backend, load_labels
+from bulk_scan import chunked, is_image_name
+from image_store import ImageStore
+from prediction_cache import file_version
+from preprocessing import IMG_SIZE, Preprocessor, decode_grayscale
+
+_preprocessor = None
+_image_stores = {}
+
+
+def iter_image_paths(inputs, file_list=None):
+    paths = list(inputs)
+    if file_list:
+        with open(file_list, "r") as f:
+            paths.extend(line.strip() for line in f if line.strip())
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if is_image_name(name):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def preprocess_chunk(paths, image_store_root=None):
+    # Runs in a worker process: decode + resize + normalize, returning one float32 batch. With
+    # image_store_root each image is also put into that ImageStore (as the app does for uploads,
+    # so rescore.py, thumbnails and Grad-CAM work for these records) and its hash returned
+    global _preprocessor
+    if _preprocessor is None:
+        _preprocessor = Preprocessor(size=IMG_SIZE, max_batch_size=1, pool_size=0)
+    image_store = None
+    if image_store_root:
+        if image_store_root not in _image_stores:
+            _image_stores[image_store_root] = ImageStore(image_store_root)
+        image_store = _image_stores[image_store_root]
+    batch = np.empty((len(paths), IMG_SIZE, IMG_SIZE, 1), dtype=np.float32)
+    ok_paths, image_hashes, failures = [], [], []
+    for path in paths:
+        try:
+            pixels = decode_grayscale(path, IMG_SIZE)
+            tensor = batch[len(ok_paths)]
+            _preprocessor.normalize_into(pixels, tensor[:, :, 0])
+            image_hashes.append(image_store.put(pixels, tensor) if image_store else None)
+            ok_paths.append(path)
+        except Exception as e:
+            failures.append((path, str(e)))
+    return ok_paths, batch[:len(ok_paths)], image_hashes, failures
+
+
+# Appends results to CSV or JSONL (chosen by extension) and reads back finished paths for --resume
+class ResultWriter:
+    def __init__(self, path):
+        self.path = path
+        self.format = "jsonl" if path.endswith((".jsonl", ".json")) else "csv"
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, "a", newline="")
+        if self.format == "csv":
+            self._csv = csv.writer(self._file)
+            if new_file:
+                self._csv.writerow(["path", "prediction", "confidence"])
+
+    @staticmethod
+    def completed_paths(path):
+        if not os.path.exists(path):
+            return set()
+        with open(path, "r", newline="") as f:
+            if path.endswith((".jsonl", ".json")):
+                return {json.loads(line)["path"] for line in f if line.strip()}
+            return {row["path"] for row in csv.DictReader(f)}
+
+    def write(self, rows):
+        for path, prediction, confidence in rows:
+            if self.format == "csv":
+                self._csv.writerow([path, prediction, f"{confidence:.4f}"])
+            else:
+                self._file.write(json.dumps({"path": path, "prediction": prediction, "confidence": round(confidence, 4)}) + "\n")
+        # Flushed per batch so an interrupted run can resume from the last written batch
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score chest X-rays without the Streamlit UI")
+    parser.add_argument("inputs", nargs="*", help="Image files and/or directories (searched recursively)")
+    parser.add_argument("--file-list", help="Text file with one image path per line")
+    parser.add_argument("--output", help="Results file (.csv or .jsonl)")
+    parser.add_argument("--db", help="Write results into patient_records of this SQLite database")
+    parser.add_argument("--patient-id", help="Patient id for --db records")
+    parser.add_argument("--image-store", default="image_store", help="Where --db records' scans are stored")
+    parser.add_argument("--model", default="best_model.h5")
+    parser.add_argument("--labels", default="class_labels.json")
+    parser.add_argument("--backend", choices=BACKENDS, default=os.environ.get("PNEUMOSCAN_BACKEND", "keras"))
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--no-resume", action="store_true", help="Rescore images already present in the output")
+    args = parser.parse_args()
+
+    if not args.output and not args.db:
+        parser.error("at least one of --output or --db is required")
+    if args.db and not args.patient_id:
+        parser.error("--db requires --patient-id")
+
+    # Finished paths per destination. The CSV row is written before the database save, so a crash
+    # between the two leaves paths in only one of them: skip only what every destination has, and
+    # write each re-scored path only where it is missing
+    in_output, in_db = set(), set()
+    if not args.no_resume:
+        if args.output:
+            in_output = ResultWriter.completed_paths(args.output)
+        if args.db:
+            db.use_database(args.db)
+            in_db = db.get_recorded_image_paths(args.patient_id)
+    if args.output and args.db:
+        done = in_output & in_db
+    else:
+        done = in_output | in_db
+    paths = [p for p in iter_image_paths(args.inputs, args.file_list) if p not in done]
+    if done:
+        print(f"Resuming: skipping {len(done)} already scored images", file=sys.stderr)
+    if not paths:
+        print("Nothing to score", file=sys.stderr)
+        return
+
+    model = load_backend(args.model, args.backend)
+    model_version = file_version(exported_model_path(args.model, args.backend))
+    class_labels = load_labels(args.labels)
+    writer = ResultWriter(args.output) if args.output else None
+    if args.db:
+        db.use_database(args.db)
+
+    scored = failed = 0
+    start = time.perf_counter()
+    chunks = chunked(paths, args.batch_size)
+    image_store_root = args.image_store if args.db else None
+    # Spawned, not forked: the model has already started TensorFlow's thread pools in this process,
+    # and forking a multi-threaded process can deadlock the children
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        # Keep a bounded number of batches in flight so decoding overlaps with predict
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append(pool.submit(preprocess_chunk, chunk, image_store_root))
+            if len(in_flight) >= args.workers * 2:
+                break
+        while in_flight:
+            ok_paths, batch, image_hashes, failures = in_flight.popleft().result()
+            next_chunk = next(chunks, None)
+            if next_chunk is not None:
+                in_flight.append(pool.submit(preprocess_chunk, next_chunk, image_store_root))
+            for path, error in failures:
+                print(f"Skipping {path}: {error}", file=sys.stderr)
+            failed += len(failures)
+            if not ok_paths:
+                continue
+
+            predictions = np.asarray(model.predict_on_batch(batch))
+            rows = [(path, class_labels[int(np.argmax(p))], float(np.max(p)) * 100)
+                    for path, p in zip(ok_paths, predictions)]
+            if writer:
+                writer.write([row for row in rows if row[0] not in in_output])
+            if args.db:
+                db.save_patient_records([(args.patient_id, prediction, confidence, path, image_hash, model_version)
+                                        for (path, prediction, confidence), image_hash in zip(rows, image_hashes)
+                                        if path not in in_db])
+            scored += len(rows)
+            elapsed = time.perf_counter() - start
+            print(f"\r{scored}/{len(paths)} scored, {scored / elapsed:.1f} images/sec", end="", file=sys.stderr)
+
+    if writer:
+        writer.close()
+    elapsed = time.perf_counter() - start
+    print(f"\nScored {scored} images ({failed} failed) in {elapsed:.1f}s: {scored / max(elapsed, 1e-9):.1f} images/sec", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+import json
+import logging
+import os
+import threading
+import time
+
+# Imported first by app.py; Streamlit re-executes the script on every rerun but
+# modules stay cached, so these marks only record the process's first start.
+PROCESS_START = time.perf_counter()
+RELEASE = os.environ.get("PNEUMOSCAN_RELEASE", "dev")
+TIMINGS_PATH = os.environ.get("PNEUMOSCAN_STARTUP_LOG", "startup_timings.jsonl")
+
+logger = logging.getLogger("pneumoscan.startup")
+_timings = {}
+_lock = threading.Lock()
+
+
+def mark(name, report=False):
+    # Seconds since process start, recorded only the first time a stage is reached.
+    # With report=True the cumulative timings are appended to TIMINGS_PATH at that point.
+    with _lock:
+        if name in _timings:
+            return _timings[name]
+        elapsed = _timings[name] = round(time.perf_counter() - PROCESS_START, 4)
+    logger.info("startup %s at %.3fs", name, elapsed)
+    if report:
+        write_report(stage=name)
+    return elapsed
+
+
+def timings():
+    with _lock:
+        return dict(_timings)
+
+
+def write_report(path=None, stage=None):
+    entry = {"release": RELEASE, "pid": os.getpid(), "stage": stage, "recorded_at": time.time(), "timings": timings()}
+    with open(path or TIMINGS_PATH, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+    return entry
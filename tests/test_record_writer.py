@@ -0,0 +1,45 @@
+import glob
+import os
+import sqlite3
+import sys
+import uuid
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db
+
+
+@pytest.fixture
+def patient_id(tmp_path):
+    previous = db.DB_PATH
+    db.use_database(str(tmp_path / "records.db"))
+    db.create_user("patient", "password", "patient", "Patient")
+    yield db.authenticate("patient", "password")["id"]
+    db.use_database(previous)
+
+
+def test_failed_group_commit_is_spilled_and_replayed(patient_id, monkeypatch):
+    writer = db.RecordWriter()
+    now = datetime.now()
+    row = (str(uuid.uuid4()), patient_id, "Normal", 90.0, None, None, None, now, 109, db.queue_rank(109, now))
+    write = db.write
+
+    def failing_write(fn, name="write"):
+        if name == "group_commit":
+            raise sqlite3.OperationalError("disk I/O error")
+        return write(fn, name)
+
+    monkeypatch.setattr(db, "write", failing_write)
+    writer._insert([row], attempts=1)
+    assert os.path.exists(writer.spill_file)
+    assert db.count_patient_records() == 0
+
+    monkeypatch.setattr(db, "write", write)
+    writer._replay_spill()
+    writer._replay_spill()
+    assert [r[0] for r in db.get_patient_records()] == [row[0]]
+    assert not os.path.exists(writer.spill_file)
+    assert not glob.glob(writer.spill_file + ".*")
+    writer.close()
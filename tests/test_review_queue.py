@@ -0,0 +1,54 @@
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db
+
+
+@pytest.fixture
+def patient_id(tmp_path):
+    previous = db.DB_PATH
+    db.use_database(str(tmp_path / "queue.db"))
+    db.create_user("patient", "password", "patient", "Patient")
+    yield db.authenticate("patient", "password")["id"]
+    db.use_database(previous)
+
+
+def test_late_submit_after_lapsed_claim_is_rejected(patient_id):
+    record_id = db.save_patient_record(patient_id, "COVID-19", 95.0)
+    assert [r[0] for r in db.claim_review_cases("docA", 1)] == [record_id]
+    # docA's lease lapses; docB takes the case over and reviews it
+    assert [r[0] for r in db.claim_review_cases("docB", 1, lease=0)] == [record_id]
+    assert db.update_prescription(record_id, "rx B", "notes B", reviewer_id="docB")
+    assert not db.update_prescription(record_id, "rx A", "notes A", reviewer_id="docA")
+    record = db.get_patient_records(status="Reviewed")[0]
+    assert (record[7], record[6]) == ("rx B", "notes B")
+
+
+def insert_record(patient_id, prediction, confidence, created_at):
+    record_id = str(uuid.uuid4())
+    priority = db.review_priority(prediction, confidence)
+    db.write(lambda conn: conn.execute(db.INSERT_RECORD_SQL, (record_id, patient_id, prediction, confidence, None, None,
+                                                              None, created_at, priority, db.queue_rank(priority, created_at))))
+    return record_id
+
+
+def test_long_waiting_case_overtakes_newer_urgent_cases(patient_id):
+    now = datetime.now()
+    fresh_covid = insert_record(patient_id, "COVID-19", 99.0, now)
+    old_normal = insert_record(patient_id, "Normal", 99.0, now - timedelta(hours=31))
+    recent_normal = insert_record(patient_id, "Normal", 99.0, now - timedelta(hours=1))
+    assert [r[0] for r in db.claim_review_cases("docA", 3)] == [old_normal, fresh_covid, recent_normal]
+
+
+def test_rescored_rank_matches_python(patient_id):
+    created_at = datetime(2024, 5, 1, 12, 30, 15, 250000)
+    record_id = insert_record(patient_id, "Normal", 90.0, created_at)
+    db.update_record_predictions([("COVID-19", 80.0, "v2", record_id)])
+    with db.connection() as conn:
+        rank = conn.execute("SELECT queue_rank FROM patient_records WHERE id = ?", (record_id,)).fetchone()[0]
+    assert rank == pytest.approx(db.queue_rank(db.review_priority("COVID-19", 80.0), created_at), abs=1e-3)
@@ -0,0 +1,327 @@
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.callbacks import Callback, EarlyStopping, LearningRateScheduler, ModelCheckpoint, ReduceLROnPlateau
+
+import training
+
+logger = logging.getLogger("pneumoscan.train")
+
+BASE_BATCH_SIZE = training.BATCH_SIZE
+BASE_LEARNING_RATE = 0.0005
+BF16_CPU_FLAGS = ("avx512_bf16", "amx_bf16")
+
+
+def cpu_supports_bf16():
+    # bfloat16 matmuls are only faster than float32 on CPUs with native bf16 instructions
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            flags = next((line.split(":", 1)[1].split() for line in f if line.startswith("flags")), [])
+    except OSError:
+        return False
+    return any(flag in flags for flag in BF16_CPU_FLAGS)
+
+
+def configure_threads(intra_op=None, inter_op=None):
+    # Must run before TensorFlow executes its first op. Defaults to one intra-op thread per
+    # core and a couple of inter-op threads, instead of the notebook's fixed 4/4
+    cores = os.cpu_count() or 1
+    intra_op = intra_op or cores
+    inter_op = inter_op or min(2, cores)
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+    return intra_op, inter_op
+
+
+def configure_precision(mode):
+    # mode is "off", "on" or "auto" (bfloat16 only where the CPU supports it natively)
+    enabled = mode == "on" or (mode == "auto" and cpu_supports_bf16())
+    policy = "mixed_bfloat16" if enabled else "float32"
+    tf.keras.mixed_precision.set_global_policy(policy)
+    return policy
+
+
+def export_float32(weights_path, output, learning_rate):
+    # best_model.h5 stores each layer's dtype policy, so a model saved under mixed_bfloat16 would
+    # also run in bfloat16 when served, emulated on CPUs without native bf16. Rebuild the model in
+    # float32 and save it with the trained weights (variables are float32 under both policies).
+    previous = tf.keras.mixed_precision.global_policy()
+    tf.keras.mixed_precision.set_global_policy("float32")
+    try:
+        model = training.build_custom_model(learning_rate)
+        model.load_weights(weights_path)
+        model.save(output)
+    finally:
+        tf.keras.mixed_precision.set_global_policy(previous)
+
+
+def scaled_learning_rate(batch_size, base_lr=BASE_LEARNING_RATE, base_batch_size=BASE_BATCH_SIZE, rule="linear"):
+    ratio = batch_size / base_batch_size
+    return base_lr * (ratio if rule == "linear" else ratio ** 0.5)
+
+
+def warmup_schedule(peak_lr, warmup_epochs):
+    # Ramps up to the scaled learning rate over the first epochs, then leaves the rate to
+    # ReduceLROnPlateau. Large batches diverge early without the ramp
+    def schedule(epoch, lr):
+        if epoch < warmup_epochs:
+            return peak_lr * (epoch + 1) / warmup_epochs
+        return lr
+    return schedule
+
+
+# Logs training images/sec, step-time percentiles and wall-clock per epoch; validation time
+# is reported separately
+class ThroughputLogger(Callback):
+    def __init__(self, num_images, config=None, log_path=None):
+        super().__init__()
+        self.num_images = num_images
+        self.config = config or {}
+        self.log_path = log_path
+        self.epochs = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_start = time.perf_counter()
+        self._train_end = None
+        self._step_times = []
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._step_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._step_times.append(time.perf_counter() - self._step_start)
+
+    def on_test_begin(self, logs=None):
+        if self._train_end is None:
+            self._train_end = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        end = time.perf_counter()
+        train_end = self._train_end or end
+        train_seconds = train_end - self._epoch_start
+        record = {
+            "epoch": epoch + 1,
+            "wall_seconds": round(end - self._epoch_start, 3),
+            "train_seconds": round(train_seconds, 3),
+            "validation_seconds": round(end - train_end, 3),
+            "images_per_sec": round(self.num_images / train_seconds, 1),
+            **step_stats(self._step_times),
+            "learning_rate": float(tf.keras.backend.get_value(self.model.optimizer.learning_rate)),
+            **{name: float(value) for name, value in (logs or {}).items()},
+        }
+        self.epochs.append(record)
+        logger.info("Epoch %d: %.1fs wall, %.1f images/sec (validation %.1fs)",
+                    record["epoch"], record["wall_seconds"], record["images_per_sec"], record["validation_seconds"])
+        if self.log_path:
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps({**self.config, **record}) + "\n")
+
+
+def step_stats(step_times):
+    # The first step of a run includes tracing and graph building, so it is reported on its own
+    if not step_times:
+        return {}
+    steps_ms = np.asarray(step_times) * 1000
+    steady = steps_ms[1:] if len(steps_ms) > 1 else steps_ms
+    return {
+        "steps": len(steps_ms),
+        "first_step_ms": round(float(steps_ms[0]), 2),
+        "step_ms_mean": round(float(steady.mean()), 2),
+        "step_ms_p50": round(float(np.percentile(steady, 50)), 2),
+        "step_ms_p95": round(float(np.percentile(steady, 95)), 2),
+        "step_ms_max": round(float(steady.max()), 2),
+    }
+
+
+# Saves model weights, optimizer slots, learning rate and the epoch counter after every
+# epoch with a CheckpointManager, plus the counters of the monitoring callbacks
+# (best val_accuracy, patience) in a JSON sidecar, so an interrupted run resumes where it
+# stopped instead of starting over.
+class TrainingCheckpoint(Callback):
+    STATE_FIELDS = ("best", "wait", "cooldown_counter")
+
+    def __init__(self, directory, monitors=(), max_to_keep=3):
+        super().__init__()
+        self.directory = directory
+        self.monitors = list(monitors)
+        self.max_to_keep = max_to_keep
+        self.state_path = os.path.join(directory, "callback_state.json")
+        self._restored_state = None
+
+    def attach(self, model):
+        self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False, name="epoch")
+        self.checkpoint = tf.train.Checkpoint(model=model, optimizer=model.optimizer, epoch=self.epoch)
+        self.manager = tf.train.CheckpointManager(self.checkpoint, self.directory, max_to_keep=self.max_to_keep)
+
+    def restore(self):
+        # Returns (initial_epoch, stopped_early) from the latest checkpoint, or (0, False)
+        if not self.manager.latest_checkpoint:
+            return 0, False
+        # Optimizer slots are created lazily; build them so they restore immediately
+        if hasattr(self.model.optimizer, "build"):
+            self.model.optimizer.build(self.model.trainable_variables)
+        self.checkpoint.restore(self.manager.latest_checkpoint).expect_partial()
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r") as f:
+                self._restored_state = json.load(f)
+        stopped = bool(self._restored_state and self._restored_state.get("stopped_early"))
+        logger.info("Resuming from %s at epoch %d", self.manager.latest_checkpoint, int(self.epoch.numpy()))
+        return int(self.epoch.numpy()), stopped
+
+    def on_train_begin(self, logs=None):
+        # Runs after the monitoring callbacks have reset themselves in their own on_train_begin
+        if not self._restored_state:
+            return
+        for monitor, state in zip(self.monitors, self._restored_state.get("monitors", [])):
+            for field, value in state.items():
+                setattr(monitor, field, value)
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.epoch.assign(epoch + 1)
+        self.manager.save(checkpoint_number=epoch + 1)
+        self._save_state(stopped_early=False)
+
+    def on_train_end(self, logs=None):
+        if self.model.stop_training:
+            self._save_state(stopped_early=True)
+
+    def _save_state(self, stopped_early):
+        state = {
+            "epoch": int(self.epoch.numpy()),
+            "stopped_early": stopped_early,
+            "monitors": [{field: float(getattr(monitor, field)) for field in self.STATE_FIELDS
+                          if getattr(monitor, field, None) is not None}
+                         for monitor in self.monitors],
+        }
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+
+# Captures a TensorFlow profiler trace for training steps [start, stop) of this run, viewable
+# in TensorBoard's Profile tab (input pipeline, op time and host-side callback gaps)
+class ProfilerWindow(Callback):
+    def __init__(self, log_dir, start, stop):
+        super().__init__()
+        self.log_dir = log_dir
+        self.start = start
+        self.stop = stop
+        self._step = 0
+        self._active = False
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self._step == self.start and not self._active:
+            tf.profiler.experimental.start(self.log_dir)
+            self._active = True
+            logger.info("Profiling steps %d-%d into %s", self.start, self.stop - 1, self.log_dir)
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._step += 1
+        if self._step >= self.stop:
+            self._finish()
+
+    def on_train_end(self, logs=None):
+        self._finish()
+
+    def _finish(self):
+        if self._active:
+            tf.profiler.experimental.stop()
+            self._active = False
+
+
+def parse_step_window(value):
+    start, _, stop = value.partition(",")
+    start, stop = int(start), int(stop)
+    if not 0 <= start < stop:
+        raise argparse.ArgumentTypeError("expected START,STOP with 0 <= START < STOP")
+    return start, stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the pneumonia classifier")
+    parser.add_argument("--dataset", default=training.BASE_DIR)
+    parser.add_argument("--output", default="best_model.h5")
+    parser.add_argument("--epochs", type=int, default=training.EPOCHS)
+    parser.add_argument("--batch-size", type=int, default=BASE_BATCH_SIZE)
+    parser.add_argument("--learning-rate", type=float, help=f"Defaults to {BASE_LEARNING_RATE} scaled by batch size / {BASE_BATCH_SIZE}")
+    parser.add_argument("--lr-scaling", choices=["linear", "sqrt"], default="linear")
+    parser.add_argument("--warmup-epochs", type=int, help="Defaults to 0 at the base batch size and 3 above it")
+    parser.add_argument("--mixed-precision", choices=["off", "on", "auto"], default="off",
+                        help="bfloat16 mixed precision; auto enables it on CPUs with AVX512-BF16/AMX")
+    parser.add_argument("--intra-op-threads", type=int, help="Defaults to the number of cores")
+    parser.add_argument("--inter-op-threads", type=int)
+    parser.add_argument("--cache-dir", default="tfdata_cache")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--metrics-log", help="Append one JSON line per epoch, including the run configuration")
+    parser.add_argument("--checkpoint-dir", default="checkpoints", help="Saved after every epoch; an existing run is resumed")
+    parser.add_argument("--fresh", action="store_true", help="Ignore existing checkpoints and start from epoch 0")
+    parser.add_argument("--profile-steps", type=parse_step_window, metavar="START,STOP",
+                        help="Capture a profiler trace for these training steps, e.g. 20,30")
+    parser.add_argument("--profile-dir", default="profiles")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    intra_op, inter_op = configure_threads(args.intra_op_threads, args.inter_op_threads)
+    policy = configure_precision(args.mixed_precision)
+    if args.seed is not None:
+        tf.keras.utils.set_random_seed(args.seed)
+
+    learning_rate = args.learning_rate or scaled_learning_rate(args.batch_size, rule=args.lr_scaling)
+    warmup_epochs = args.warmup_epochs if args.warmup_epochs is not None else (3 if args.batch_size > BASE_BATCH_SIZE else 0)
+    config = {"batch_size": args.batch_size, "policy": policy, "intra_op_threads": intra_op,
+              "inter_op_threads": inter_op, "peak_learning_rate": learning_rate, "warmup_epochs": warmup_epochs}
+    logger.info("Training with %s", config)
+
+    train, val, _, weights, _ = training.make_datasets(args.dataset, args.batch_size, cache_dir=args.cache_dir, seed=args.seed)
+    num_images = len(training.list_split(os.path.join(args.dataset, "train"))[0])
+    model = training.build_custom_model(learning_rate)
+
+    # Same monitoring as Cell 8 of PDD.ipynb, plus warmup, throughput logging and checkpoints. In mixed
+    # precision only the best weights are kept during training and exported as float32 at the end
+    mixed = policy != "float32"
+    best_weights = os.path.splitext(args.output)[0] + ".weights.h5"
+    monitors = [
+        ModelCheckpoint(best_weights if mixed else args.output, monitor='val_accuracy', save_best_only=True,
+                        mode='max', save_weights_only=mixed, verbose=1),
+        EarlyStopping(monitor='val_accuracy', patience=5, restore_best_weights=True, verbose=1),
+        ReduceLROnPlateau(monitor='val_accuracy', factor=0.5, patience=2, min_lr=1e-6, verbose=1),
+    ]
+    throughput = ThroughputLogger(num_images, config, args.metrics_log)
+    checkpoint = TrainingCheckpoint(args.checkpoint_dir, monitors)
+    checkpoint.set_model(model)
+    checkpoint.attach(model)
+    initial_epoch, stopped_early = (0, False) if args.fresh else checkpoint.restore()
+    if stopped_early or initial_epoch >= args.epochs:
+        logger.info("Checkpointed run already finished at epoch %d; pass --fresh to retrain", initial_epoch)
+        if mixed and os.path.exists(best_weights):
+            export_float32(best_weights, args.output, learning_rate)
+        return
+
+    callbacks = monitors + [throughput]
+    if warmup_epochs:
+        callbacks.insert(0, LearningRateScheduler(warmup_schedule(learning_rate, warmup_epochs)))
+    if args.profile_steps:
+        callbacks.append(ProfilerWindow(args.profile_dir, *args.profile_steps))
+    # Last, so its on_train_begin restores monitor state after they reset themselves
+    callbacks.append(checkpoint)
+
+    start = time.perf_counter()
+    model.fit(train, validation_data=val, epochs=args.epochs, initial_epoch=initial_epoch,
+              class_weight=weights, callbacks=callbacks)
+    elapsed = time.perf_counter() - start
+    if mixed and os.path.exists(best_weights):
+        export_float32(best_weights, args.output, learning_rate)
+        logger.info("Saved float32 serving model %s from %s", args.output, best_weights)
+    rates = [epoch["images_per_sec"] for epoch in throughput.epochs[1:] or throughput.epochs]
+    logger.info("Training completed in %.1fs over %d epochs; %.1f images/sec after the first (cache-filling) epoch",
+                elapsed, len(throughput.epochs), sum(rates) / len(rates))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import glob
+import os
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import BatchNormalization, Conv2D, Dense, Dropout, Flatten, MaxPooling2D
+from tensorflow.keras.models import Sequential
+from tensorflow.keras.optimizers import Adam
+
+from bulk_scan import is_image_name
+
+# Same configuration as PDD.ipynb
+IMG_SIZE = 150
+BATCH_SIZE = 16
+EPOCHS = 35
+CLASSES = ['COVID-19', 'Normal', 'Pneumonia-Bacterial', 'Pneumonia-Viral']
+BASE_DIR = os.environ.get("PNEUMOSCAN_DATASET", "Processed Dataset")
+AUTOTUNE = tf.data.AUTOTUNE
+
+
+def build_custom_model(learning_rate=0.0005):
+    model = Sequential([
+        Conv2D(32, (3, 3), activation='relu', padding='same', input_shape=(IMG_SIZE, IMG_SIZE, 1)),
+        BatchNormalization(),
+        Conv2D(32, (3, 3), activation='relu', padding='same'),
+        BatchNormalization(),
+        MaxPooling2D((2, 2)),
+        Dropout(0.2),
+
+        Conv2D(64, (3, 3), activation='relu', padding='same'),
+        BatchNormalization(),
+        Conv2D(64, (3, 3), activation='relu', padding='same'),
+        BatchNormalization(),
+        MaxPooling2D((2, 2)),
+        Dropout(0.3),
+
+        Conv2D(128, (3, 3), activation='relu', padding='same'),
+        BatchNormalization(),
+        Conv2D(128, (3, 3), activation='relu', padding='same'),
+        BatchNormalization(),
+        MaxPooling2D((2, 2)),
+        Dropout(0.3),
+
+        Flatten(),
+        Dense(256, activation='relu'),
+        BatchNormalization(),
+        Dropout(0.5),
+        # Softmax kept in float32 so predictions stay stable under a mixed precision policy
+        Dense(len(CLASSES), activation='softmax', dtype='float32')
+    ])
+
+    model.compile(
+        optimizer=Adam(learning_rate=learning_rate),
+        loss='categorical_crossentropy',
+        metrics=['accuracy']
+    )
+
+    return model
+
+
+def list_split(data_dir, classes=CLASSES):
+    # Same layout and class order flow_from_directory uses: one sub-folder per class
+    paths, labels = [], []
+    for index, label in enumerate(classes):
+        class_dir = os.path.join(data_dir, label)
+        for root, _, files in sorted(os.walk(class_dir)):
+            for name in sorted(files):
+                if is_image_name(name):
+                    paths.append(os.path.join(root, name))
+                    labels.append(index)
+    return paths, np.array(labels, dtype=np.int32)
+
+
+def class_weights(labels, num_classes=len(CLASSES)):
+    # Same balancing as Cell 5 of PDD.ipynb
+    counts = np.bincount(labels, minlength=num_classes)
+    total = counts.sum()
+    return {i: total / (num_classes * count) for i, count in enumerate(counts) if count}
+
+
+def decode_image(path, label):
+    image = tf.io.decode_image(tf.io.read_file(path), channels=1, expand_animations=False)
+    image = tf.image.resize(image, (IMG_SIZE, IMG_SIZE), method="bilinear")
+    # Cached as uint8 so the on-disk cache is 4x smaller than float32
+    return tf.cast(tf.round(image), tf.uint8), label
+
+
+def build_augmenter(seed=None):
+    # Vectorized, batch-level equivalent of the notebook's ImageDataGenerator settings
+    # (shear has no core Keras layer and is left out)
+    return tf.keras.Sequential([
+        tf.keras.layers.RandomRotation(15 / 360, fill_mode="nearest", seed=seed),
+        tf.keras.layers.RandomTranslation(0.15, 0.15, fill_mode="nearest", seed=seed),
+        tf.keras.layers.RandomZoom(0.15, fill_mode="nearest", seed=seed),
+        tf.keras.layers.RandomFlip("horizontal", seed=seed),
+    ], name="augmentation")
+
+
+def remove_partial_cache(prefix):
+    # tf.data writes the .index file only once the first epoch has read the whole split. Without
+    # it, files under the prefix are left over from a run that crashed while filling the cache,
+    # and their .lockfile would make this run fail with AlreadyExistsError
+    if os.path.exists(prefix + ".index"):
+        return
+    for path in glob.glob(glob.escape(prefix) + "[._]*"):
+        os.remove(path)
+
+
+def make_dataset(data_dir, batch_size=BATCH_SIZE, training=False, cache_dir=None, augment=None,
+                 num_shards=8, shuffle_buffer=2048, seed=None):
+    # Returns (dataset, labels). Files are read and decoded by num_shards interleaved readers,
+    # decoded 150x150 images are cached (on disk when cache_dir is given), then shuffled,
+    # batched, normalized/augmented per batch and prefetched.
+    paths, labels = list_split(data_dir)
+    if not paths:
+        raise ValueError(f"No images found under {data_dir}")
+    files = tf.data.Dataset.from_tensor_slices((paths, labels))
+    num_shards = max(1, min(num_shards, len(paths)))
+    # With deterministic round-robin over shards of stride num_shards, evaluation splits come
+    # out in the original file order, so predictions line up with the returned labels
+    dataset = tf.data.Dataset.range(num_shards).interleave(
+        lambda shard: files.shard(num_shards, shard).map(decode_image),
+        cycle_length=num_shards, num_parallel_calls=AUTOTUNE, deterministic=not training)
+
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        split = os.path.basename(os.path.normpath(data_dir))
+        prefix = os.path.join(cache_dir, f"{split}_{IMG_SIZE}")
+        remove_partial_cache(prefix)
+        dataset = dataset.cache(prefix)
+    else:
+        dataset = dataset.cache()
+
+    if training:
+        dataset = dataset.shuffle(min(shuffle_buffer, len(paths)), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size, drop_remainder=False)
+
+    if augment is None:
+        augment = training
+    augmenter = build_augmenter(seed) if augment else None
+    num_classes = len(CLASSES)
+
+    def prepare(images, batch_labels):
+        images = tf.cast(images, tf.float32) / 255.0
+        if augmenter is not None:
+            images = augmenter(images, training=True)
+        return images, tf.one_hot(batch_labels, num_classes)
+
+    dataset = dataset.map(prepare, num_parallel_calls=AUTOTUNE).prefetch(AUTOTUNE)
+    return dataset, labels
+
+
+def make_datasets(base_dir=BASE_DIR, batch_size=BATCH_SIZE, cache_dir="tfdata_cache", seed=None):
+    train, train_labels = make_dataset(os.path.join(base_dir, "train"), batch_size, training=True, cache_dir=cache_dir, seed=seed)
+    val, _ = make_dataset(os.path.join(base_dir, "val"), batch_size, cache_dir=cache_dir)
+    test, test_labels = make_dataset(os.path.join(base_dir, "test"), batch_size, cache_dir=cache_dir)
+    return train, val, test, class_weights(train_labels), test_labels
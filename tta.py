@@ -0,0 +1,77 @@
+import threading
+
+import numpy as np
+
+from backends import load_backend
+
+# Pixels of shift for the shifted views; the model was trained with up to 15% (22 px) shifts
+DEFAULT_SHIFT = 8
+
+
+def augment_views(tensor, flip=True, shift=DEFAULT_SHIFT, out=None):
+    # Views of one preprocessed (size, size, 1) scan: the original, its horizontal flip and
+    # shifts by +/-shift pixels along each axis with edge pixels repeated (the training fill mode)
+    count = 1 + int(flip) + (4 if shift else 0)
+    if out is None:
+        out = np.empty((count,) + tensor.shape, dtype=np.float32)
+    out[0] = tensor
+    i = 1
+    if flip:
+        out[i] = tensor[:, ::-1]
+        i += 1
+    if shift:
+        padded = np.pad(tensor, ((shift, shift), (shift, shift), (0, 0)), mode="edge")
+        size_y, size_x = tensor.shape[:2]
+        for dy, dx in ((shift, 0), (-shift, 0), (0, shift), (0, -shift)):
+            out[i] = padded[shift - dy:shift - dy + size_y, shift - dx:shift - dx + size_x]
+            i += 1
+    return out[:count]
+
+
+# Extra checkpoints averaged with the serving model. Each model sees all views in one call;
+# calls are serialized because sessions share the loaded models.
+class Ensemble:
+    def __init__(self, model_paths, backend="keras"):
+        self.model_paths = list(model_paths)
+        self.models = [load_backend(path, backend) for path in self.model_paths]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.models)
+
+    def predict_on_batch(self, views):
+        with self._lock:
+            return [np.asarray(model.predict_on_batch(views)) for model in self.models]
+
+
+# Re-scores low-confidence scans with test-time augmentation and/or an ensemble. predict_batch
+# runs the serving model on an (n, size, size, 1) array in a single model call (e.g.
+# InferenceEngine.predict_batch); the views of every scan being refined go into that one call.
+class Refiner:
+    def __init__(self, predict_batch, threshold, flip=True, shift=DEFAULT_SHIFT, ensemble=None):
+        self.predict_batch = predict_batch
+        self.threshold = threshold
+        self.flip = flip
+        self.shift = shift
+        self.ensemble = ensemble
+
+    @property
+    def views_per_scan(self):
+        return 1 + int(self.flip) + (4 if self.shift else 0)
+
+    def should_refine(self, confidence):
+        # confidence is in percent, like process_xray's result
+        return confidence < self.threshold
+
+    def refine(self, tensors):
+        # Returns the mean probabilities over all views (and ensemble members) for each tensor
+        per_scan = self.views_per_scan
+        views = np.empty((len(tensors) * per_scan,) + tensors[0].shape, dtype=np.float32)
+        for i, tensor in enumerate(tensors):
+            augment_views(tensor, self.flip, self.shift, out=views[i * per_scan:(i + 1) * per_scan])
+        predictions = [np.asarray(self.predict_batch(views))]
+        if self.ensemble:
+            predictions.extend(self.ensemble.predict_on_batch(views))
+        # (members, scans, views, classes) -> average over members and views
+        stacked = np.stack(predictions).reshape(len(predictions), len(tensors), per_scan, -1)
+        return stacked.mean(axis=(0, 2))
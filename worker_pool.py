@@ -0,0 +1,285 @@
+import atexit
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import metrics
+from inference import BATCH_SIZE, PREDICT_SECONDS, QUEUE_WAIT
+from preprocessing import IMG_SIZE
+
+logger = logging.getLogger("pneumoscan.worker_pool")
+
+INPUT_SHAPE = (IMG_SIZE, IMG_SIZE, 1)
+IN_FLIGHT = metrics.gauge("pneumoscan_worker_pool_in_flight", "Requests submitted to model worker processes and not yet answered")
+
+
+def _worker_main(model_path, backend, num_threads, input_name, output_name, slots, num_classes,
+                 max_batch_size, requests, responses):
+    # Runs in a spawned process. Only lists of slot numbers travel over the queues; tensors are
+    # read from and results written to the shared-memory rings. Each list is one request whose
+    # rows always go through the same model call
+    if backend == "keras":
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    from backends import load_backend
+
+    input_shm = shared_memory.SharedMemory(name=input_name)
+    output_shm = shared_memory.SharedMemory(name=output_name)
+    inputs = np.ndarray((slots,) + INPUT_SHAPE, dtype=np.float32, buffer=input_shm.buf)
+    outputs = np.ndarray((slots, num_classes), dtype=np.float32, buffer=output_shm.buf)
+    batch = np.empty((max_batch_size,) + INPUT_SHAPE, dtype=np.float32)
+    try:
+        model = load_backend(model_path, backend, num_threads=num_threads)
+        responses.put(("ready", None, 0.0))
+        stop = False
+        while not stop:
+            group = requests.get()
+            if group is None:
+                break
+            # Batch whatever else is already queued for this worker
+            groups = [group]
+            rows = len(group)
+            while rows < max_batch_size:
+                try:
+                    group = requests.get_nowait()
+                except queue.Empty:
+                    break
+                if group is None:
+                    stop = True
+                    break
+                groups.append(group)
+                rows += len(group)
+            batch_slots = [slot for group in groups for slot in group]
+            if rows > len(batch):
+                batch = np.empty((rows,) + INPUT_SHAPE, dtype=np.float32)
+            np.take(inputs, batch_slots, axis=0, out=batch[:rows])
+            # time.monotonic is system-wide, so the parent compares it with its submit times
+            started = time.monotonic()
+            start = time.perf_counter()
+            try:
+                outputs[batch_slots] = np.asarray(model.predict_on_batch(batch[:rows]))
+            except Exception as e:
+                responses.put(("error", groups, str(e)))
+                continue
+            responses.put(("done", groups, (started, time.perf_counter() - start)))
+    finally:
+        del inputs, outputs
+        input_shm.close()
+        output_shm.close()
+
+
+def _deadline(timeout):
+    return None if timeout is None else time.monotonic() + timeout
+
+
+def _remaining(deadline):
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+# One model worker process with its own pair of shared-memory rings: `slots` preprocessed
+# (150, 150, 1) float32 inputs and the matching probability outputs. Slots are handed out and
+# returned in FIFO order, so the ring fills and drains like a circular buffer.
+class _Worker:
+    def __init__(self, ctx, index, model_path, backend, num_threads, slots, num_classes, max_batch_size):
+        self.index = index
+        self.slots = slots
+        self.input_shm = shared_memory.SharedMemory(create=True, size=slots * int(np.prod(INPUT_SHAPE)) * 4)
+        self.output_shm = shared_memory.SharedMemory(create=True, size=slots * num_classes * 4)
+        self.inputs = np.ndarray((slots,) + INPUT_SHAPE, dtype=np.float32, buffer=self.input_shm.buf)
+        self.outputs = np.ndarray((slots, num_classes), dtype=np.float32, buffer=self.output_shm.buf)
+        self.free = queue.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+        # Only one submitter takes slots at a time, so two multi-slot requests can never each
+        # hold part of a full ring and wait on each other
+        self.acquire_lock = threading.Lock()
+        # (future, slots, single, queued) stored at the first slot of each request
+        self.requests_by_slot = [None] * slots
+        self.in_flight = 0
+        self.alive = True
+        self.requests = ctx.Queue()
+        self.responses = ctx.Queue()
+        self.process = ctx.Process(
+            target=_worker_main, name=f"model-worker-{index}", daemon=True,
+            args=(model_path, backend, num_threads, self.input_shm.name, self.output_shm.name,
+                  slots, num_classes, max_batch_size, self.requests, self.responses))
+        self.process.start()
+
+    def close(self):
+        del self.inputs, self.outputs
+        for shm in (self.input_shm, self.output_shm):
+            shm.close()
+            shm.unlink()
+
+
+# Pool of model worker processes with the same interface as InferenceEngine. Decode and
+# preprocessing stay in the caller; model compute runs outside this process's GIL, and each
+# request goes to the worker with the fewest requests in flight.
+class WorkerPool:
+    def __init__(self, model_path="best_model.h5", backend="keras", num_workers=None, num_classes=4,
+                 slots_per_worker=128, max_batch_size=16, threads_per_worker=None):
+        cores = os.cpu_count() or 1
+        self.num_workers = num_workers or max(1, cores // 2)
+        threads_per_worker = threads_per_worker or max(1, cores // self.num_workers)
+        self.max_batch_size = max_batch_size
+        self.slots_per_worker = slots_per_worker
+        ctx = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._order = itertools.count()
+        self._workers = [_Worker(ctx, i, model_path, backend, threads_per_worker, slots_per_worker, num_classes, max_batch_size)
+                         for i in range(self.num_workers)]
+        self._listeners = [threading.Thread(target=self._listen, args=(worker,), name=f"model-worker-{i}-results", daemon=True)
+                           for i, worker in enumerate(self._workers)]
+        for listener in self._listeners:
+            listener.start()
+        self._closed = False
+        IN_FLIGHT.set_function(self.queue_depth)
+        atexit.register(self.shutdown)
+
+    def _pick_worker(self, count=1):
+        # Least-loaded live worker; ties rotate so idle workers share the load
+        with self._lock:
+            live = [w for w in self._workers if w.alive]
+            if not live:
+                raise RuntimeError("all model workers have exited")
+            offset = next(self._order)
+            worker = min(live, key=lambda w: (w.in_flight, (w.index - offset) % self.num_workers))
+            worker.in_flight += count
+            return worker
+
+    def _submit(self, image_tensors, single, timeout=None):
+        # Copies the preprocessed tensors into free slots of the chosen worker's ring; blocks while
+        # that ring is full, which applies backpressure to the callers
+        if self._closed:
+            raise RuntimeError("worker pool is shut down")
+        count = len(image_tensors)
+        worker = self._pick_worker(count)
+        slots = []
+        try:
+            with worker.acquire_lock:
+                for _ in range(count):
+                    slots.append(worker.free.get(timeout=timeout))
+        except queue.Empty:
+            for slot in slots:
+                worker.free.put(slot)
+            with self._lock:
+                worker.in_flight -= count
+            raise TimeoutError(f"model worker {worker.index} has no free slots")
+        future = Future()
+        future.set_running_or_notify_cancel()
+        # Registered under the same lock _worker_exited takes to mark the worker dead, so a request
+        # is either swept up by that worker's exit or refused here, never left unresolved
+        with self._lock:
+            alive = worker.alive
+            if alive:
+                worker.requests_by_slot[slots[0]] = (future, slots, single, time.monotonic())
+            else:
+                worker.in_flight -= count
+        if not alive:
+            for slot in slots:
+                worker.free.put(slot)
+            raise RuntimeError(f"model worker {worker.index} exited")
+        for slot, tensor in zip(slots, image_tensors):
+            worker.inputs[slot] = tensor
+        worker.requests.put(slots)
+        return future
+
+    def submit(self, image_tensor, timeout=None):
+        return self._submit([image_tensor], single=True, timeout=timeout)
+
+    def submit_batch(self, image_tensors, timeout=None):
+        # All rows go to one worker and through the same model call
+        if len(image_tensors) > self.slots_per_worker:
+            raise ValueError(f"at most {self.slots_per_worker} images per batch")
+        return self._submit(image_tensors, single=False, timeout=timeout)
+
+    def predict_batch(self, image_tensors, timeout=None):
+        deadline = _deadline(timeout)
+        return self.submit_batch(image_tensors, timeout=_remaining(deadline)).result(timeout=_remaining(deadline))
+
+    def predict(self, image_tensor, timeout=None):
+        deadline = _deadline(timeout)
+        return self.submit(image_tensor, timeout=_remaining(deadline)).result(timeout=_remaining(deadline))
+
+    def predict_many(self, image_tensors, timeout=None):
+        # As in predict and predict_batch, timeout bounds the whole call (waiting for free slots
+        # plus every result), not each future separately
+        deadline = _deadline(timeout)
+        futures = [self.submit(t, timeout=_remaining(deadline)) for t in image_tensors]
+        return [f.result(timeout=_remaining(deadline)) for f in futures]
+
+    def queue_depth(self):
+        with self._lock:
+            return sum(w.in_flight for w in self._workers)
+
+    def _finish(self, worker, groups, error=None):
+        finished = 0
+        for slots in groups:
+            future, _, single, _ = worker.requests_by_slot[slots[0]]
+            worker.requests_by_slot[slots[0]] = None
+            if error is not None:
+                future.set_exception(error)
+            else:
+                # Copied out before the slots are reused
+                future.set_result(worker.outputs[slots[0]].copy() if single else worker.outputs[slots].copy())
+            for slot in slots:
+                worker.free.put(slot)
+            finished += len(slots)
+        with self._lock:
+            worker.in_flight -= finished
+
+    def _listen(self, worker):
+        while True:
+            try:
+                kind, groups, detail = worker.responses.get(timeout=1.0)
+            except queue.Empty:
+                if worker.process.is_alive():
+                    continue
+                self._worker_exited(worker)
+                return
+            if kind == "ready":
+                logger.info("Model worker %d ready", worker.index)
+            elif kind == "done":
+                started, predict_seconds = detail
+                BATCH_SIZE.observe(sum(len(slots) for slots in groups))
+                PREDICT_SECONDS.observe(predict_seconds)
+                for slots in groups:
+                    # From submit until the worker took the request into a batch
+                    QUEUE_WAIT.observe(max(0.0, started - worker.requests_by_slot[slots[0]][3]))
+                self._finish(worker, groups)
+            else:
+                metrics.ERRORS.inc(stage="predict")
+                self._finish(worker, groups, error=RuntimeError(detail))
+
+    def _worker_exited(self, worker):
+        with self._lock:
+            worker.alive = False
+        if self._closed:
+            return
+        logger.error("Model worker %d exited with code %s", worker.index, worker.process.exitcode)
+        outstanding = [request[1] for request in worker.requests_by_slot if request is not None]
+        if outstanding:
+            self._finish(worker, outstanding, error=RuntimeError(f"model worker {worker.index} exited"))
+
+    def shutdown(self):
+        # Requests already queued are still served before each worker exits
+        if self._closed:
+            return
+        self._closed = True
+        for worker in self._workers:
+            worker.requests.put(None)
+        for worker in self._workers:
+            worker.process.join()
+        for listener in self._listeners:
+            listener.join()
+        for worker in self._workers:
+            worker.close()